@@ -1,23 +1,55 @@
 from instagrapi import Client
+import hashlib
 import time
-import random
 import signal
+import threading
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime
-from config import API_KEY, SESSION_ID, OWNER_USERNAME, PROMPT_FIRST_TEMPLATE, PROMPT_SECOND_TEMPLATE, BOT_NAME, THREAD_FETCH_AMOUNT, MESSAGE_FETCH_AMOUNT, MIN_SLEEP_TIME, MAX_SLEEP_TIME
-import google.generativeai as genai
-from google.generativeai.types import FunctionDeclaration, Tool
+from config import API_KEY, SESSION_ID, OWNER_USERNAME, PROMPT_SYSTEM_INSTRUCTION, PROMPT_FIRST_TEMPLATE, PROMPT_SECOND_TEMPLATE, BOT_NAME, THREAD_FETCH_AMOUNT, MESSAGE_FETCH_AMOUNT, MIN_SLEEP_TIME, MAX_SLEEP_TIME, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, MESSAGE_HISTORY_LIMIT, WATERMARK_WINDOW, CHAT_MAX_SESSIONS, CHAT_MAX_TURNS, CHAT_MAX_TOKENS, CHAT_IDLE_TTL, THREAD_WORKERS, INCREMENTAL_SYNC, POLL_BACKOFF_FACTOR, POLL_JITTER, HOT_THREAD_WINDOW, COLD_THREAD_EVERY, STATE_DB_PATH, SESSION_SETTINGS_PATH, COALESCE_WINDOW, SEND_RATE, SEND_BURST, SEND_MAX_RETRIES, SEND_RESULT_TIMEOUT, FOLLOWS_CACHE_TTL, FOLLOWS_PAGE_SIZE, HISTORY_LENGTH, TOOL_WORKERS, TOOL_TIMEOUT, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, STREAM_REPLIES, SEND_ACKNOWLEDGMENT, METRICS_PORT, METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL, RECORD_TRAFFIC_PATH, RECORD_REDACT, CLIENT_RATE, CLIENT_BURST, CLIENT_BUDGETS, BREAKER_THRESHOLD, BREAKER_BASE_DELAY, BREAKER_MAX_DELAY, HISTORY_TOKEN_BUDGET, PRIORITY_CONCURRENCY, ESCALATION_WINDOW, HISTORY_PAGE_SIZE
+from cache import TTLCache
+from store import HistoryIndex, MessageRecord, ThreadStore, ThreadWatermark, UsernameIndex
+from sessions import ChatSessionManager, estimate_text_tokens
+from scheduler import PollScheduler
+from persistence import StateStore, load_session, save_session
+from outbox import SendQueue
+from templates import PromptTemplate
+from metrics import Metrics, TOKEN_BUCKETS
+from recording import TrafficRecorder, set_call_thread
+from guard import ClientGuard, CircuitBreaker
+from workqueue import PriorityWorkQueue
 
+boot_started_at = time.perf_counter()
+metrics = Metrics()
 cl = Client()
+# Optionally record all Instagram and Gemini traffic so it can be replayed offline
+recorder = TrafficRecorder(RECORD_TRAFFIC_PATH, redact=RECORD_REDACT) if RECORD_TRAFFIC_PATH else None
+if recorder is not None:
+    cl = recorder.wrap_client(cl)
+# Every Instagram call goes through per-endpoint budgets and a circuit breaker that pauses calls while we are throttled
+guard = ClientGuard(rate=CLIENT_RATE, burst=CLIENT_BURST, budgets=CLIENT_BUDGETS, breaker=CircuitBreaker(threshold=BREAKER_THRESHOLD, base_delay=BREAKER_BASE_DELAY, max_delay=BREAKER_MAX_DELAY), metrics=metrics)
+cl = guard.wrap(cl)
 auto_responding = {}
 owner_id = None
 bot_id = None
-genai.configure(api_key=API_KEY)
+bot_username = None
 start_time = datetime.now()
-last_checked_timestamps = {}
 all_threads = {}
-processed_message_ids = set()
+watermarks = {}
+scheduler = PollScheduler(min_interval=MIN_SLEEP_TIME, max_interval=MAX_SLEEP_TIME, backoff=POLL_BACKOFF_FACTOR, jitter=POLL_JITTER, hot_window=HOT_THREAD_WINDOW, cold_every=COLD_THREAD_EVERY)
+state_lock = threading.RLock()  # Guards adding/iterating threads in the shared state dicts across workers
+state_store = StateStore(STATE_DB_PATH, history_limit=MESSAGE_HISTORY_LIMIT) if STATE_DB_PATH else None
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+username_index = UsernameIndex()
+history_index = HistoryIndex()  # searchable view of every stored message, kept in sync by the ThreadStores
+follow_lists_cache = TTLCache(maxsize=256, ttl=FOLLOWS_CACHE_TTL)
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL) if RESPONSE_CACHE_ENABLED else None
+escalated_threads = TTLCache(maxsize=1000, ttl=ESCALATION_WINDOW)  # threads the owner was recently notified about
+# Threads are processed in this order of priority; the owner's own threads come first
+PRIORITY_CLASSES = ("owner", "escalation", "regular")
+outbox = SendQueue(cl, rate=SEND_RATE, burst=SEND_BURST, max_retries=SEND_MAX_RETRIES, metrics=metrics, pause=guard.breaker.retry_in)
 
-notify_owner_func = FunctionDeclaration(
+notify_owner_func = dict(
     name="notify_owner",
     description=f"Notify the owner ({OWNER_USERNAME}) about a message with detailed context.",
     parameters={
@@ -34,17 +66,17 @@ notify_owner_func = FunctionDeclaration(
     }
 )
 
-pause_response_func = FunctionDeclaration(
+pause_response_func = dict(
     name="pause_auto_response",
     description="Pause the auto-response feature for a specific thread.",
 )
 
-resume_response_func = FunctionDeclaration(
+resume_response_func = dict(
     name="resume_auto_response",
     description="Resume the auto-response feature for a specific thread.",
 )
 
-target_thread_func = FunctionDeclaration(
+target_thread_func = dict(
     name="target_thread",
     description=f"Directs Raphael to focus on a specific thread by thread_id or target_username. Only callable by {OWNER_USERNAME}.",
     parameters={
@@ -56,7 +88,7 @@ target_thread_func = FunctionDeclaration(
     }
 )
 
-send_message_func = FunctionDeclaration(
+send_message_func = dict(
     name="send_message",
     description="Sends a message to a specified user, multiple users (comma-separated usernames), or thread. Use comma-separated usernames in target_username for multiple recipients.",
     parameters={
@@ -70,23 +102,37 @@ send_message_func = FunctionDeclaration(
     }
 )
 
-list_threads_func = FunctionDeclaration(
+list_threads_func = dict(
     name="list_threads",
-    description=f"Lists all active threads. Only callable by {OWNER_USERNAME}."
+    description=f"Lists active threads, most recently active first, one page at a time. Only callable by {OWNER_USERNAME}.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Only list threads with a user whose username contains this text (optional)"},
+            "page": {"type": "integer", "description": "Page number, starting at 1 (optional, defaults to 1)"},
+            "limit": {"type": "integer", "description": f"Threads per page (optional, defaults to {HISTORY_PAGE_SIZE})"}
+        }
+    }
 )
 
-view_dms_func = FunctionDeclaration(
+view_dms_func = dict(
     name="view_dms",
-    description=f"Views all past DMs in a thread since script start. Only callable by {OWNER_USERNAME}.",
+    description=f"Searches past DMs since script start, newest first, one page at a time. Only callable by {OWNER_USERNAME}.",
     parameters={
         "type": "object",
         "properties": {
-            "thread_id": {"type": "string", "description": "The thread ID to view DMs for (optional; if omitted, shows all threads)"}
+            "thread_id": {"type": "string", "description": "The thread ID to search (optional; if omitted, searches all threads when username, query, since or until is given, otherwise the current thread)"},
+            "username": {"type": "string", "description": "Only messages sent by this username (optional)"},
+            "query": {"type": "string", "description": "Only messages containing all of these words (optional)"},
+            "since": {"type": "string", "description": "Only messages on or after this date, as YYYY-MM-DD or YYYY-MM-DD HH:MM (optional)"},
+            "until": {"type": "string", "description": "Only messages on or before this date, as YYYY-MM-DD or YYYY-MM-DD HH:MM (optional)"},
+            "page": {"type": "integer", "description": "Page number, starting at 1 (optional, defaults to 1)"},
+            "limit": {"type": "integer", "description": f"Messages per page (optional, defaults to {HISTORY_PAGE_SIZE})"}
         }
     }
 )
 
-fetch_followers_followings_func = FunctionDeclaration(
+fetch_followers_followings_func = dict(
     name="fetch_followers_followings",
     description="Fetches the usernames of followers and followings of a specified Instagram account.",
     parameters={
@@ -99,7 +145,8 @@ fetch_followers_followings_func = FunctionDeclaration(
     }
 )
 
-tools = Tool(function_declarations=[
+# The function declarations stay plain dicts until the model is built
+function_declarations = [
     notify_owner_func,
     pause_response_func,
     resume_response_func,
@@ -108,18 +155,99 @@ tools = Tool(function_declarations=[
     list_threads_func,
     view_dms_func,
     fetch_followers_followings_func
-])
+]
+
+# The static instructions go in the system instruction, so every request starts with the same prefix
+system_instruction = PromptTemplate(PROMPT_SYSTEM_INSTRUCTION).render(owner_username=OWNER_USERNAME)
+
+def build_model():
+    """Configures Gemini and builds the model; the Gemini SDK is slow to import, so this waits until the model is first needed."""
+    import google.generativeai as genai
+    from google.generativeai.types import FunctionDeclaration, Tool
+    genai.configure(api_key=API_KEY)
+    tools = Tool(function_declarations=[FunctionDeclaration(**declaration) for declaration in function_declarations])
+    model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20", tools=[tools], system_instruction=system_instruction)
+    if recorder is not None:
+        model = recorder.wrap_model(model)
+    return model
+
+chat_sessions = ChatSessionManager(None, max_sessions=CHAT_MAX_SESSIONS, max_turns=CHAT_MAX_TURNS, max_tokens=CHAT_MAX_TOKENS, idle_ttl=CHAT_IDLE_TTL, model_factory=build_model)
 
-model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20", tools=[tools])
+# Prompt templates are parsed once; the owner's username never changes, so it is baked in up front
+prompt_first_template = PromptTemplate(PROMPT_FIRST_TEMPLATE).bind(owner_username=OWNER_USERNAME)
+prompt_second_template = PromptTemplate(PROMPT_SECOND_TEMPLATE).bind(owner_username=OWNER_USERNAME)
+placeholder_pattern = re.compile(r"\[\[(\w+)\]\]")
+sentence_end_pattern = re.compile(r"[.!?](?:\s+)")
+paragraph_end_pattern = re.compile(r"\n\s*\n")
 
 def format_message(template_string: str, **kwargs) -> str:
     """
-    Replaces placeholders in a template string with values from kwargs.
-    Placeholders are in the format [[placeholder_name]].
+    Replaces placeholders in a template string with values from kwargs in a single pass.
+    Placeholders are in the format [[placeholder_name]]; unknown placeholders are left as they are.
+    """
+    return placeholder_pattern.sub(lambda match: str(kwargs[match.group(1)]) if match.group(1) in kwargs else match.group(0), template_string)
+
+def response_cache_key(message_text, is_owner):
+    """
+    Builds the response cache key for the first message of a conversation: its text lowercased with
+    punctuation and extra whitespace removed, plus the sender's role. Returns None for empty messages.
+    """
+    normalized = " ".join(re.sub(r"[^\w\s]", " ", (message_text or "").lower()).split())
+    if not normalized:
+        return None
+    return (normalized, "owner" if is_owner else "user")
+
+def depersonalize_reply(text, **values):
+    """Turns sender-specific values in a reply back into [[placeholders]] so the cached reply can be reused for anyone."""
+    for key, value in sorted(values.items(), key=lambda item: -len(str(item[1] or ""))):
+        if value and len(str(value)) > 2:
+            # Only whole words, so a name that is also part of another word is left alone
+            text = re.sub(rf"(?<!\w){re.escape(str(value))}(?!\w)", f"[[{key}]]", text)
+    return text
+
+def get_user_info(user_id):
+    """Returns the profile for a user ID, only calling Instagram if it is not in the profile cache."""
+    user_id = str(user_id)
+
+    def load_user_info():
+        with metrics.timed("user_info"):
+            return cl.user_info_v1(user_id)
+
+    user_info = profile_cache.get_or_load(user_id, load_user_info)
+    username_index.add_user(user_info.username, user_info.pk)
+    return user_info
+
+def resolve_user_id(username):
+    """Returns the user ID for a username, only calling Instagram if it is not in the username index."""
+    user_id = username_index.user_id(username)
+    if user_id is None:
+        with metrics.timed("user_id_from_username"):
+            user_id = cl.user_id_from_username(username)
+        username_index.add_user(username, user_id)
+    return user_id
+
+def fetch_follow_list(user_id, kind, max_count):
+    """
+    Returns up to max_count usernames of a user's followers or followings (kind is "followers" or "following").
+    Pages are fetched with instagrapi's max_id cursor and cached together with the cursor,
+    so a later request for more users resumes where the previous one stopped.
     """
-    for key, value in kwargs.items():
-        template_string = template_string.replace(f"[[{key}]]", str(value))
-    return template_string
+    key = (str(user_id), kind)
+    entry = follow_lists_cache.get(key) or {"usernames": [], "seen": set(), "cursor": ""}
+    fetch_chunk = cl.user_followers_v1_chunk if kind == "followers" else cl.user_following_v1_chunk
+    while len(entry["usernames"]) < max_count and entry["cursor"] is not None:
+        page_size = min(FOLLOWS_PAGE_SIZE, max_count - len(entry["usernames"]))
+        with metrics.timed("follow_list", kind=kind):
+            users, next_cursor = fetch_chunk(str(user_id), max_amount=page_size, max_id=entry["cursor"])
+        for user in users:
+            if user.pk not in entry["seen"]:
+                entry["seen"].add(user.pk)
+                entry["usernames"].append(user.username)
+        entry["cursor"] = next_cursor or None  # None means the whole list has been fetched
+        if not users:
+            break
+    follow_lists_cache.set(key, entry)
+    return entry["usernames"][:max_count]
 
 def send_message_to_owner(message, thread_id, sender_username=None, sender_full_name=None, timestamp=None, sender_follower_count=None):
     """Sends a formatted message to the bot owner."""
@@ -144,21 +272,442 @@ def send_message_to_owner(message, thread_id, sender_username=None, sender_full_
             timestamp=timestamp or 'Unknown',
             sender_follower_count=int(sender_follower_count) if sender_follower_count else 'Unknown'
         )
-        cl.direct_send(full_message, [owner_id])
-        print(f"Sent message to {OWNER_USERNAME}: {full_message}")
+        outbox.send(full_message, user_ids=[owner_id], urgent=True)
+        print(f"Queued message to {OWNER_USERNAME}: {full_message}")
     except Exception as e:
         print(f"Failed to send message to owner: {e}")
 
-def login():
-    """Logs into Instagram using the session ID and fetches bot and owner IDs."""
-    global owner_id, bot_id
+class ToolContext:
+    """Details of the message that triggered a function call, passed to every tool handler."""
+    __slots__ = ("thread_id", "sender_username", "sender_full_name", "timestamp", "sender_follower_count", "message_text", "urgent")
+
+    def __init__(self, thread_id, sender_username, sender_full_name, timestamp, sender_follower_count, message_text, urgent=False):
+        self.thread_id = thread_id
+        self.sender_username = sender_username
+        self.sender_full_name = sender_full_name
+        self.timestamp = timestamp
+        self.sender_follower_count = sender_follower_count
+        self.message_text = message_text
+        self.urgent = urgent  # sends to this thread go ahead of regular threads' messages
+
+def send_reply(context, text):
+    """Fills in the [[placeholders]] of a model reply and queues it to the context's thread."""
+    reply = format_message(
+        text,
+        thread_id=str(context.thread_id),
+        sender_username=context.sender_username,
+        sender_full_name=context.sender_full_name,
+        timestamp=context.timestamp,
+        sender_follower_count=str(context.sender_follower_count),
+        owner_username=OWNER_USERNAME
+    )
+    outbox.send(reply, thread_ids=[context.thread_id], urgent=context.urgent)
+    print(f"Responded in thread {context.thread_id} with: {reply}")
+
+def trim_history(lines, budget):
+    """Keeps the most recent history lines that fit within `budget` estimated tokens."""
+    kept = []
+    for line in reversed(lines):
+        budget -= estimate_text_tokens(line)
+        if budget < 0:
+            break
+        kept.append(line)
+    kept.reverse()
+    return kept
+
+def report_token_usage(usage, context):
+    """Prints and records the token counts Gemini reports for one request."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens)
+    metrics.inc("llm_output_tokens_total", output_tokens)
+    metrics.inc("llm_cached_tokens_total", cached_tokens)
+    metrics.observe("llm_prompt_tokens", prompt_tokens, buckets=TOKEN_BUCKETS)
+    print(f"Token usage for thread {context.thread_id}: {prompt_tokens} prompt ({cached_tokens} cached), {output_tokens} output")
+
+def get_model_reply(chat, prompt, context):
+    """
+    Sends a prompt to a thread's chat and sends the text of the reply to the user.
+    With STREAM_REPLIES the response is read as it is generated: the first complete
+    sentence is sent as soon as it arrives, then each complete paragraph, then the rest.
+    Returns the function calls and the text pieces of the reply.
+    """
+    function_calls = []
+    text_replies = []
+    metrics.inc("llm_calls_total")
+    if not STREAM_REPLIES:
+        response = chat.send_message(prompt)
+        print(f"Response parts for thread {context.thread_id}: {response.parts}")
+        report_token_usage(getattr(response, "usage_metadata", None), context)
+        for part in response.parts:
+            if part.function_call:
+                function_calls.append(part.function_call)
+            elif part.text:
+                text_replies.append(part.text.strip())
+                send_reply(context, part.text.strip())
+        return function_calls, text_replies
+
+    buffer = ""
+    usage = None
+    for chunk in chat.send_message(prompt, stream=True):
+        # Each chunk carries the usage so far; the last one has the totals
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        for part in chunk.parts:
+            if part.function_call:
+                function_calls.append(part.function_call)
+            elif part.text:
+                buffer += part.text
+                while True:
+                    # The first piece is at least a sentence of some substance; later pieces are whole paragraphs
+                    match = paragraph_end_pattern.search(buffer) if text_replies else sentence_end_pattern.search(buffer, 40)
+                    if not match:
+                        break
+                    piece, buffer = buffer[:match.end()].strip(), buffer[match.end():]
+                    if piece:
+                        text_replies.append(piece)
+                        send_reply(context, piece)
+    if buffer.strip():
+        text_replies.append(buffer.strip())
+        send_reply(context, buffer.strip())
+    print(f"Streamed {len(text_replies)} reply piece(s) and {len(function_calls)} function call(s) for thread {context.thread_id}")
+    report_token_usage(usage, context)
+    return function_calls, text_replies
+
+tool_handlers = {}  # function name -> (handler, owner_only, timeout)
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+def tool(name, owner_only=False, timeout=None):
+    """
+    Registers a handler for a Gemini function call. Handlers take (context, args)
+    and return a sentence describing the outcome, which is passed back to the model.
+    """
+    def register(handler):
+        tool_handlers[name] = (handler, owner_only, timeout or TOOL_TIMEOUT)
+        return handler
+    return register
+
+@tool("notify_owner")
+def notify_owner_tool(context, args):
+    """Sends a message to the bot owner."""
+    message_content = args["message"]
+    # Replace placeholders in the message content before sending
+    formatted_message_content = format_message(
+        message_content,
+        thread_id=str(args.get("thread_id", context.thread_id)),
+        sender_username=args.get("sender_username", context.sender_username),
+        sender_full_name=args.get("sender_full_name", context.sender_full_name),
+        timestamp=args.get("timestamp", context.timestamp),
+        sender_follower_count=str(args.get("sender_follower_count", context.sender_follower_count)),
+        owner_username=OWNER_USERNAME
+    )
+    send_message_to_owner(
+        formatted_message_content,
+        args.get("thread_id", context.thread_id),
+        args.get("sender_username", context.sender_username),
+        args.get("sender_full_name", context.sender_full_name),
+        args.get("timestamp", context.timestamp),
+        args.get("sender_follower_count", context.sender_follower_count)
+    )
+    escalated_threads.set(context.thread_id, True)
+    print(f"Elevated awareness in thread {context.thread_id}")
+    return f"The message sent to my owner was: {formatted_message_content}"
+
+@tool("pause_auto_response")
+def pause_auto_response_tool(context, args):
+    """Pauses auto-responses for the current thread."""
+    auto_responding[context.thread_id] = False
+    print(f"Auto-response paused in thread {context.thread_id}")
+    return "Auto-response is now paused for this thread."
+
+@tool("resume_auto_response")
+def resume_auto_response_tool(context, args):
+    """Resumes auto-responses for the current thread."""
+    auto_responding[context.thread_id] = True
+    print(f"Auto-response resumed in thread {context.thread_id}")
+    return "Auto-response is now resumed for this thread."
+
+@tool("target_thread", owner_only=True)
+def target_thread_tool(context, args):
+    """Changes focus to a different thread, by thread ID or username."""
+    target_thread_id = args.get("thread_id")
+    target_username = args.get("target_username")
+    if target_thread_id:
+        print(f"Targeting thread {target_thread_id} as requested by {OWNER_USERNAME}")
+    elif target_username:
+        target_thread_id = username_index.thread_id(target_username)
+        if not target_thread_id:
+            # Not seen by the poll loop yet; fall back to scanning the inbox
+            with metrics.timed("direct_threads"):
+                inbox_threads = cl.direct_threads(amount=MESSAGE_FETCH_AMOUNT) # Use configured amount
+            for t in inbox_threads:
+                username_index.add_thread(t.id, t.users)
+                if any(user.username == target_username for user in t.users):
+                    target_thread_id = t.id
+                    break
+        if target_thread_id:
+            print(f"Targeting thread {target_thread_id} with username {target_username} as requested by {OWNER_USERNAME}")
+        else:
+            print(f"No thread found with username {target_username}")
+            return f"No thread was found with username {target_username}."
+    if not target_thread_id:
+        return "No thread ID or username was given to target."
+    return f"I am now targeting thread {target_thread_id} as requested."
+
+@tool("send_message")
+def send_message_tool(context, args):
+    """Sends a message to a thread, to one or more comma-separated usernames, or to the current thread."""
+    message_to_send = args["message"]
+    target_username = args.get("target_username")
+    target_thread_id = args.get("thread_id")
+    sent_to_users = []
+    failed_to_users = []
+    try:
+        if target_thread_id:
+            outbox.send(message_to_send, thread_ids=[target_thread_id]).result(timeout=SEND_RESULT_TIMEOUT)
+            print(f"Sent message '{message_to_send}' to thread {target_thread_id}")
+            sent_to_users.append(f"thread {target_thread_id}")
+        elif target_username:
+            target_usernames = [u.strip() for u in target_username.split(",")]
+            # Queue every recipient first so the sends go out back to back, then collect the results
+            pending_sends = []
+            for username_to_send in target_usernames:
+                # Known one-to-one threads are addressed directly, which also lets the outbox combine the sends
+                known_thread_id = username_index.thread_id(username_to_send)
+                if known_thread_id:
+                    pending_sends.append((username_to_send, known_thread_id, outbox.send(message_to_send, thread_ids=[known_thread_id])))
+                    continue
+                try:
+                    user_id = resolve_user_id(username_to_send)
+                except Exception as e:
+                    print(f"Failed to get user ID for username {username_to_send}: {e}")
+                    failed_to_users.append(username_to_send)
+                    continue # Skip this username
+                pending_sends.append((username_to_send, user_id, outbox.send(message_to_send, user_ids=[user_id])))
+            for username_to_send, recipient_id, send_future in pending_sends:
+                try:
+                    send_future.result(timeout=SEND_RESULT_TIMEOUT)
+                    sent_to_users.append(username_to_send)
+                    print(f"Sent message '{message_to_send}' to {username_to_send}")
+                except Exception as e:
+                    failed_to_users.append(username_to_send)
+                    print(f"Failed to send message to {username_to_send} (ID: {recipient_id}): {e}")
+        else:
+            outbox.send(message_to_send, thread_ids=[context.thread_id]).result(timeout=SEND_RESULT_TIMEOUT)
+            print(f"Sent message '{message_to_send}' to current thread {context.thread_id}")
+            sent_to_users.append("this thread")
+    except Exception as e:
+        print(f"Failed to send message: {e}")
+        failed_to_users.append(target_username or target_thread_id or "this thread")
+    sent_to_str = ', '.join(sent_to_users) if sent_to_users else 'None'
+    failed_to_str = ', '.join(failed_to_users) if failed_to_users else 'None'
+    return f"I attempted to send the message: {message_to_send} - Successfully sent to: {sent_to_str}, Failed to send to: {failed_to_str}"
+
+def page_arguments(args):
+    """Returns the (offset, limit, page) asked for by a paged tool call, keeping the page size bounded."""
+    limit = max(1, min(int(args.get("limit") or HISTORY_PAGE_SIZE), HISTORY_PAGE_SIZE * 5))
+    page = max(1, int(args.get("page") or 1))
+    return (page - 1) * limit, limit, page
+
+def page_footer(page, limit, total, noun):
+    pages = max(1, -(-total // limit))
+    footer = f"Page {page} of {pages} ({total} {noun})."
+    if page < pages:
+        footer += f" Ask for page {page + 1} to see more."
+    return footer
+
+def shorten(text, length):
+    text = text or ""
+    return text if len(text) <= length else text[:length - 1] + "…"
+
+def parse_date_argument(value, end_of_day=False):
+    """Parses a YYYY-MM-DD or YYYY-MM-DD HH:MM tool argument; a bare date used as an upper bound covers the whole day."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.strip())
+    if end_of_day and len(value.strip()) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    return parsed
+
+@tool("list_threads", owner_only=True)
+def list_threads_tool(context, args):
+    """Lists one page of the known threads and their users, most recently active first."""
+    offset, limit, page = page_arguments(args)
+    query = (args.get("query") or "").strip().lstrip("@").lower()
+    with state_lock:
+        known_threads = list(all_threads.items())
+    if query:
+        known_threads = [(tid, info) for tid, info in known_threads if any(query in (username or "").lower() for username in info.users)]
+    last_activity = {tid: max((m.timestamp for m in list(info)), default=datetime.min) for tid, info in known_threads}
+    known_threads.sort(key=lambda entry: last_activity[entry[0]], reverse=True)
+    thread_list = "\n".join([
+        f"Thread {tid}: Users: {', '.join(info.users)}, {len(info)} messages" + (f", last active {last_activity[tid]:%Y-%m-%d %H:%M}" if len(info) else "")
+        for tid, info in known_threads[offset:offset + limit]
+    ])
+    return f"Here’s the result: Here are the active threads:\n{thread_list}\n{page_footer(page, limit, len(known_threads), 'threads')}"
+
+@tool("view_dms", owner_only=True)
+def view_dms_tool(context, args):
+    """Shows one page of the stored DMs matching the thread, user, keyword and date filters, newest first."""
+    offset, limit, page = page_arguments(args)
+    username = args.get("username")
+    query = args.get("query")
+    # Without any filter the owner is asking about the current conversation
+    view_thread_id = args.get("thread_id") or (None if username or query or args.get("since") or args.get("until") else context.thread_id)
     try:
-        cl.login_by_sessionid(SESSION_ID)
-        bot_info = cl.user_info_v1(cl.user_id)
-        bot_id = bot_info.pk
-        owner_info = cl.user_info_by_username_v1(OWNER_USERNAME)
-        owner_id = owner_info.pk
-        print(f"Logged in as {cl.username}, bot ID: {bot_id}, owner ID: {owner_id}")
+        since = parse_date_argument(args.get("since"))
+        until = parse_date_argument(args.get("until"), end_of_day=True)
+    except ValueError as e:
+        return f"Here’s the result: The date could not be understood ({e}); use YYYY-MM-DD."
+    total, matches = history_index.search(thread_id=view_thread_id, user=username, query=query, since=since, until=until, offset=offset, limit=limit)
+    scope = f"thread {view_thread_id}" if view_thread_id else "all threads"
+    if not total:
+        return f"Here’s the result: No DMs found in {scope} matching the request"
+    dms = "\n".join([
+        f"{m.timestamp:%Y-%m-%d %H:%M:%S} - " + (f"[thread {tid}] " if not view_thread_id else "") + f"{m.username}: {shorten(m.text, 300)}"
+        for tid, m in matches
+    ])
+    return f"Here’s the result: Past DMs in {scope}, newest first:\n{dms}\n{page_footer(page, limit, total, 'messages')}"
+
+@tool("fetch_followers_followings", timeout=120)
+def fetch_followers_followings_tool(context, args):
+    """Fetches the follower and following usernames of an account."""
+    target_username_fetch = args["target_username"]
+    max_count = int(args.get("max_count", 50)) # Default to 50 if not specified
+    try:
+        user_id = resolve_user_id(target_username_fetch)
+        # The returned users already carry usernames, so no per-user profile lookups are needed
+        with ThreadPoolExecutor(max_workers=2) as follow_pool:
+            followers_future = follow_pool.submit(fetch_follow_list, user_id, "followers", max_count)
+            followings_future = follow_pool.submit(fetch_follow_list, user_id, "following", max_count)
+            followers_usernames = followers_future.result()
+            followings_usernames = followings_future.result()
+        fetched_data = f"Followers of {target_username_fetch} (up to {max_count}): {', '.join(followers_usernames)}\n" \
+                       f"Followings of {target_username_fetch} (up to {max_count}): {', '.join(followings_usernames)}"
+        print(f"Fetched followers and followings for {target_username_fetch}")
+    except Exception as e:
+        fetched_data = f"Failed to fetch data for {target_username_fetch}: {str(e)}"
+        print(f"Error fetching followers/followings: {e}")
+    return f"Here’s the fetched data: {fetched_data}"
+
+def execute_tool(name, args, context):
+    """Runs the registered handler for a function call, enforcing owner-only restrictions."""
+    if name not in tool_handlers:
+        return f"The function {name} is not available."
+    handler, owner_only, _ = tool_handlers[name]
+    if owner_only and context.sender_username != OWNER_USERNAME:
+        print(f"Refused owner-only function {name} requested by {context.sender_username}")
+        return f"The function {name} is only available to {OWNER_USERNAME}."
+    with metrics.timed("tool", tool=name):
+        return handler(context, args)
+
+class ToolCall:
+    """A function call submitted to the tool pool, recording when it started running."""
+    __slots__ = ("name", "timeout", "started", "started_at", "future")
+
+    def __init__(self, name, args, context):
+        self.name = name
+        self.timeout = tool_handlers.get(name, (None, False, TOOL_TIMEOUT))[2]
+        self.started = threading.Event()
+        self.started_at = None
+        self.future = tool_executor.submit(self.run, args, context)
+
+    def run(self, args, context):
+        self.started_at = time.monotonic()
+        self.started.set()
+        return execute_tool(self.name, args, context)
+
+def run_tool_calls(function_calls, context):
+    """
+    Runs all function calls from one model response concurrently. Each call gets its
+    tool's timeout from the moment it starts running; a call still waiting for a free
+    worker after that long is cancelled instead of being run late.
+    Returns (name, result) pairs in the order the calls were made.
+    """
+    submitted_at = time.monotonic()
+    calls = [ToolCall(call.name, dict(call.args or {}), context) for call in function_calls]
+    results = []
+    for call in calls:
+        name, timeout, future = call.name, call.timeout, call.future
+        try:
+            if not call.started.wait(max(0.0, submitted_at + timeout - time.monotonic())) and future.cancel():
+                print(f"Function {name} could not start within {timeout}s in thread {context.thread_id}")
+                results.append((name, f"The function could not start within {timeout} seconds because other functions were still running."))
+                continue
+            call.started.wait()
+            results.append((name, future.result(timeout=max(0.0, call.started_at + timeout - time.monotonic()))))
+        except FuturesTimeoutError:
+            # A running call cannot be interrupted; it finishes in the background and its result is dropped
+            print(f"Function {name} timed out after {timeout}s in thread {context.thread_id}")
+            results.append((name, f"The function did not finish within {timeout} seconds."))
+        except Exception as e:
+            print(f"Function {name} failed in thread {context.thread_id}: {e}")
+            results.append((name, f"The function failed with an error: {e}"))
+    return results
+
+def session_fingerprint():
+    """Identifies the configured session ID without writing it to disk."""
+    return hashlib.sha256(SESSION_ID.encode()).hexdigest()
+
+def resume_session():
+    """
+    Restores the client settings, bot ID and owner ID saved by the last login. They are
+    only used if they were saved for the configured session ID and owner, and the restored
+    client is logged in as the saved bot; the first poll then confirms the session still works.
+    """
+    global owner_id, bot_id, bot_username
+    saved = load_session(SESSION_SETTINGS_PATH)
+    if not saved or saved.get("session") != session_fingerprint() or saved.get("owner_username") != OWNER_USERNAME:
+        return False
+    cl.set_settings(saved["settings"])
+    if str(cl.user_id) != str(saved["bot_id"]):
+        print(f"Saved session in {SESSION_SETTINGS_PATH} is for another account, logging in again")
+        return False
+    bot_id, bot_username, owner_id = saved["bot_id"], saved["bot_username"], saved["owner_id"]
+    username_index.add_user(OWNER_USERNAME, owner_id)
+    return True
+
+def save_login_session():
+    """Saves the client settings, bot ID and owner ID so the next start can skip logging in."""
+    if not SESSION_SETTINGS_PATH or bot_id is None:
+        return
+    try:
+        save_session(SESSION_SETTINGS_PATH, {
+            "session": session_fingerprint(),
+            "owner_username": OWNER_USERNAME,
+            "bot_id": str(bot_id),
+            "bot_username": bot_username,
+            "owner_id": str(owner_id),
+            "settings": cl.get_settings(),
+        })
+    except Exception as e:
+        print(f"Failed to save the login session to {SESSION_SETTINGS_PATH}: {e}")
+
+def login(fresh=False):
+    """
+    Logs into Instagram. Unless `fresh`, the session saved by the last login is reused
+    without any Instagram calls; otherwise logs in with the session ID, fetches the bot
+    and owner IDs and saves them for the next start.
+    """
+    global owner_id, bot_id, bot_username
+    try:
+        if not fresh and SESSION_SETTINGS_PATH and resume_session():
+            print(f"Resumed saved session as {bot_username}, bot ID: {bot_id}, owner ID: {owner_id}")
+        else:
+            cl.login_by_sessionid(SESSION_ID)
+            bot_info = get_user_info(cl.user_id)
+            bot_id = bot_info.pk
+            bot_username = bot_info.username
+            owner_info = cl.user_info_by_username_v1(OWNER_USERNAME)
+            owner_id = owner_info.pk
+            username_index.add_user(owner_info.username, owner_id)
+            print(f"Logged in as {bot_username}, bot ID: {bot_id}, owner ID: {owner_id}")
+            save_login_session()
+        guard.login_required = False
+        if recorder is not None:
+            recorder.write_header(bot_id, bot_username, OWNER_USERNAME)
         return True
     except Exception as e:
         print(f"Login failed: {e}")
@@ -167,7 +716,7 @@ def login():
 def print_user_info():
     """Prints the logged-in user's profile information."""
     try:
-        user_info = cl.user_info_v1(cl.user_id)
+        user_info = get_user_info(cl.user_id)
         print(f"Username: {user_info.username}")
         print(f"Full Name: {user_info.full_name}")
         print(f"Biography: {user_info.biography}")
@@ -175,359 +724,402 @@ def print_user_info():
     except Exception as e:
         print(f"Failed to retrieve user info: {e}")
 
-def auto_respond():
+def warm_up():
+    """Does the start-up work polling does not wait for: building the Gemini model and printing the bot's profile."""
+    try:
+        chat_sessions.load_model()
+    except Exception as e:
+        print(f"Failed to build the Gemini model: {e}")
+    print_user_info()
+
+def load_state():
+    """
+    Restores per-thread state and message history saved by a previous run, and moves
+    the cutoff for unseen threads back to the last poll so messages received while
+    the bot was down are still answered.
+    """
+    global start_time
+    if state_store is None:
+        return
+    last_poll_at = state_store.get_meta("last_poll_at")
+    if last_poll_at:
+        start_time = min(start_time, datetime.fromtimestamp(float(last_poll_at)))
+    restored = 0
+    with state_lock:
+        for thread_id, users, responding, watermark in state_store.load_threads(window=WATERMARK_WINDOW):
+            auto_responding[thread_id] = responding
+            watermarks[thread_id] = watermark
+            all_threads[thread_id] = ThreadStore(users=users, maxlen=MESSAGE_HISTORY_LIMIT, history_limit=HISTORY_LENGTH, thread_id=thread_id, search_index=history_index)
+            for record in state_store.load_messages(thread_id, limit=MESSAGE_HISTORY_LIMIT):
+                all_threads[thread_id].add(record)
+            restored += 1
+    print(f"Restored state for {restored} threads from {STATE_DB_PATH}, resuming from {start_time}")
+
+def save_thread_state(thread_id):
+    """Queues the current state of a thread to be written to the state store at the end of the cycle."""
+    if state_store is None:
+        return
+    with state_lock:
+        if thread_id not in watermarks:
+            return
+        state_store.save_thread(thread_id, all_threads[thread_id].users, auto_responding[thread_id], watermarks[thread_id])
+
+def coalesce_messages(messages):
+    """
+    Groups consecutive messages (oldest first) from the same sender into bursts,
+    so a user who sends several short messages in a row gets a single reply.
+    """
+    bursts = []
+    for msg in messages:
+        if bursts and str(bursts[-1][-1].user_id) == str(msg.user_id):
+            bursts[-1].append(msg)
+        else:
+            bursts.append([msg])
+    return bursts
+
+def process_thread(thread):
+    """
+    Fetches and answers the new messages of a single thread.
+    Messages within a thread are always handled one at a time, oldest first.
+    """
+    global auto_responding, all_threads, watermarks
+    new_messages = []
+    try:
+        thread_id = thread.id
+        set_call_thread(thread_id)
+        with state_lock:
+            # Initialize auto-response state for new threads
+            if thread_id not in auto_responding:
+                auto_responding[thread_id] = True
+            # Initialize thread information storage
+            if thread_id not in all_threads:
+                all_threads[thread_id] = ThreadStore(users=[user.username for user in thread.users], maxlen=MESSAGE_HISTORY_LIMIT, history_limit=HISTORY_LENGTH, thread_id=thread_id, search_index=history_index)
+            # Initialize the processed-message watermark, treating everything before script start as handled
+            if thread_id not in watermarks:
+                watermarks[thread_id] = ThreadWatermark(start_time, window=WATERMARK_WINDOW)
+            watermark = watermarks[thread_id]
+            thread_store = all_threads[thread_id]
+        username_index.add_thread(thread_id, thread.users)
+
+        # Fetch messages in the current thread
+        if INCREMENTAL_SYNC and thread.messages:
+            # The inbox listing already carries the thread's newest items; skip the thread if they are all processed
+            unseen_inline = [msg for msg in thread.messages if not watermark.is_processed(msg)]
+            if not unseen_inline:
+                print(f"No new messages in thread {thread_id}")
+                return
+            # Only page through the thread if every inline item is new, i.e. there may be more new items beyond them
+            if len(unseen_inline) < len(thread.messages):
+                messages = unseen_inline
+            else:
+                with metrics.timed("direct_messages"):
+                    messages = [msg for msg in cl.direct_messages(thread_id, amount=MESSAGE_FETCH_AMOUNT) if not watermark.is_processed(msg)]
+        else:
+            with metrics.timed("direct_messages"):
+                messages = cl.direct_messages(thread_id, amount=MESSAGE_FETCH_AMOUNT)
+        # Store new messages in all_threads for history, oldest first so the ring buffer evicts the oldest
+        for msg in sorted(messages, key=lambda m: m.timestamp):
+            if msg.timestamp > start_time and msg.id not in thread_store:
+                try:
+                    msg_sender_username = get_user_info(msg.user_id).username
+                except Exception as e:
+                    print(f"Error fetching username for message {msg.id} in thread {thread_id}: {e}")
+                    msg_sender_username = "UnknownUser"
+                record = MessageRecord(msg.id, msg.user_id, msg_sender_username, msg.text, msg.timestamp)
+                if thread_store.add(record) and state_store is not None:
+                    state_store.save_message(thread_id, record)
+
+        # Filter for messages past the thread's watermark, oldest first
+        new_messages = [msg for msg in sorted(messages, key=lambda m: m.timestamp) if not watermark.is_processed(msg)]
+        if not new_messages:
+            print(f"No new messages in thread {thread_id}")
+            return
+        if any(str(msg.user_id) != str(bot_id) for msg in new_messages):
+            scheduler.mark_activity(thread_id)
+
+        bursts = coalesce_messages(new_messages)
+        for burst_index, burst in enumerate(bursts):
+            # A burst of messages from one sender is answered as a single message
+            message = burst[-1]
+            message_id = message.id
+            is_own_message = str(message.user_id) == str(bot_id)
+
+            # If the sender may still be typing, leave the latest burst unprocessed so it is picked up with any follow-ups next poll
+            if COALESCE_WINDOW and not is_own_message and burst_index == len(bursts) - 1 and (datetime.now() - message.timestamp).total_seconds() < COALESCE_WINDOW:
+                print(f"Waiting up to {COALESCE_WINDOW}s for more messages from {message.user_id} in thread {thread_id}")
+                break
+
+            # Mark the messages as processed up front so a failure below never causes them to be answered twice
+            for msg in burst:
+                watermark.mark(msg)
+
+            # Ignore bot's own messages to prevent self-reply loops.
+            if is_own_message:
+                print(f"Ignoring bot's own message {message_id} in thread {thread_id}: {message.text}")
+                continue
+
+            message_text = "\n".join(msg.text for msg in burst if msg.text)
+            if len(burst) > 1:
+                print(f"Coalesced {len(burst)} messages from {message.user_id} in thread {thread_id}")
+            sender_id = message.user_id
+            try:
+                sender_info = get_user_info(sender_id)
+                sender_username = sender_info.username
+                sender_full_name = sender_info.full_name
+                sender_follower_count = sender_info.follower_count
+            except Exception as e:
+                print(f"Error fetching sender info for user ID {sender_id} in thread {thread_id}: {e}")
+                # Fallback values if sender info cannot be fetched
+                sender_username = "UnknownUser"
+                sender_full_name = "Unknown User"
+                sender_follower_count = 0 # Default follower count
+                # Optionally, skip this message if sender info is critical
+                # print(f"Skipping message {message_id} due to sender info fetch failure.")
+                # continue 
+            timestamp = message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+            # Every send to an owner or escalated thread is urgent, so none of them waits behind regular threads
+            urgent = thread_priority(thread) != "regular"
+
+            # If auto-response is paused for this thread, check if the message is a command to resume.
+            if not auto_responding[thread_id]:
+                print(f"{time.ctime()} - Auto-response paused for thread {thread_id}, checking for resume command")
+                if message_text and any(keyword in message_text.lower() for keyword in ["resume", "start", "enable", "unpause", "continue"]):
+                    auto_responding[thread_id] = True
+                    outbox.send("Auto-response resumed for this thread.", thread_ids=[thread_id], urgent=urgent)
+                    print(f"Auto-response resumed in thread {thread_id}")
+                continue
+
+            print(f"New DM in thread {thread_id} from {sender_username}: {message_text}")
+            metrics.inc("messages_handled_total", len(burst))
+
+            # Construct conversation history for the prompt from the thread's rolling history, including past messages from the user and the bot.
+            prompt_build_started_at = time.perf_counter()
+            conversation_history = []
+            for history_user_id, history_text_line in list(thread_store.history):
+                if history_user_id == str(sender_id) or history_user_id == str(bot_id):
+                    role = "User" if history_user_id == str(sender_id) else "Raphael"
+                    conversation_history.append(f"{role}: {history_text_line}")
+
+            context = ToolContext(thread_id, sender_username, sender_full_name, timestamp, sender_follower_count, message_text, urgent)
+
+            # Answer repeated questions from the response cache without calling the model
+            cache_key = None
+            # The history already contains the messages being answered, so anything beyond them is earlier conversation.
+            # Later replies can depend on that conversation, so only the first message of a conversation is cached
+            if response_cache is not None and len(conversation_history) <= len(burst):
+                cache_key = response_cache_key(message_text, sender_username == OWNER_USERNAME)
+                cached_replies = response_cache.get(cache_key) if cache_key else None
+                if cached_replies is not None:
+                    print(f"Answering message {message_id} in thread {thread_id} from the response cache")
+                    metrics.inc("response_cache_answers_total")
+                    for cached_reply in cached_replies:
+                        send_reply(context, cached_reply)
+                    continue
+
+            # Send an initial acknowledgment to the user.
+            if SEND_ACKNOWLEDGMENT:
+                outbox.send("request acknowledged. Please wait for Raphael to respond....", thread_ids=[thread_id], urgent=urgent)
+                print(f"Queued acknowledgment in thread {thread_id}")
+
+            if HISTORY_TOKEN_BUDGET > 0:
+                conversation_history = trim_history(conversation_history, HISTORY_TOKEN_BUDGET)
+            history_text = "\n".join(conversation_history)
+
+            prompt_first = prompt_first_template.render(
+                bot_username_in_context=bot_username,
+                current_date=datetime.now().strftime('%Y-%m-%d'),
+                sender_username=sender_username,
+                thread_id=thread_id,
+                sender_full_name=sender_full_name,
+                timestamp=timestamp,
+                sender_follower_count=sender_follower_count,
+                history_text=history_text,
+                message_text=message_text
+            )
+            metrics.observe("stage_seconds", time.perf_counter() - prompt_build_started_at, stage="prompt_build")
+            # Each thread has its own chat session so context never leaks between conversations
+            chat = chat_sessions.get(thread_id)
+            try:
+                print(f"Sending first request to Gemini API for thread {thread_id}")
+                # Any text in the response is sent directly to the user; function calls are collected and run below
+                with metrics.timed("gemini", request="first"):
+                    function_calls, text_replies = get_model_reply(chat, prompt_first, context)
+            except Exception as e:
+                print(f"Error sending first request to Gemini API for thread {thread_id}, message {message_id}: {e}")
+                continue # Skip to the next message; it is already marked processed so it is not retried indefinitely
+            # Later requests get the history from the prompt, so the chat only keeps what the user said
+            chat_sessions.compact_turn(chat, prompt_first, message_text)
+
+            # Only plain text answers are cached; anything involving a function call depends on live state
+            if cache_key and text_replies and not function_calls:
+                response_cache.set(cache_key, tuple(
+                    depersonalize_reply(text, sender_username=sender_username, sender_full_name=sender_full_name, thread_id=thread_id)
+                    for text in text_replies
+                ))
+
+            # If functions were triggered, run them together and send one more request to the API to explain the results to the user.
+            if function_calls:
+                tool_results = run_tool_calls(function_calls, context)
+                function_results = "\n".join(f"* `{name}`: {result}" for name, result in tool_results)
+
+                prompt_second = prompt_second_template.render(
+                    bot_username_in_context=bot_username,
+                    sender_username=sender_username,
+                    message_text=message_text,
+                    thread_id=thread_id,
+                    function_results=function_results,
+                    sender_full_name=sender_full_name, # Added missing placeholder
+                    timestamp=timestamp,
+                    sender_follower_count=sender_follower_count
+                )
+                try:
+                    print(f"Sending second request to Gemini API for thread {thread_id}")
+                    with metrics.timed("gemini", request="second"):
+                        _, second_replies = get_model_reply(chat, prompt_second, context)
+                    chat_sessions.compact_turn(chat, prompt_second, f"Function results:\n{function_results}")
+                    if not second_replies:
+                        print(f"No text reply in second response for thread {thread_id}")
+                except Exception as e:
+                    print(f"Error sending second request to Gemini API or processing its response for thread {thread_id}, message {message_id}: {e}")
+                    # No need to send a message to user here as the interaction is already complex.
+    except Exception as e:
+        metrics.inc("errors_total", stage="process_thread")
+        print(f"Error processing thread {thread.id}: {e}")
+    finally:
+        if new_messages:
+            save_thread_state(thread.id)
+
+def thread_priority(thread):
+    """Returns the priority class of a thread: "owner" if the owner is in it, "escalation" if the owner was recently notified about it, else "regular"."""
+    if owner_id is not None and any(str(user.pk) == str(owner_id) for user in thread.users):
+        return "owner"
+    if escalated_threads.get(thread.id):
+        return "escalation"
+    return "regular"
+
+def auto_respond(stop=None):
     """
     Main loop for automatically responding to Instagram direct messages.
     Fetches new messages, processes them using a generative AI model,
     and handles function calls triggered by the model.
+    Threads are processed in priority order: the owner's threads, then threads
+    escalated to the owner, then everyone else (see thread_priority()).
+    With THREAD_WORKERS > 1, threads are processed concurrently on a priority work
+    queue, which by default keeps one worker free for the owner and escalations;
+    a thread is never queued twice, so messages within a thread keep their order.
+    If a threading.Event is given as `stop`, the loop returns once it is set and
+    the threads still being processed have finished.
+    The start of the last cycle whose threads were all processed is saved as
+    last_poll_at, which load_state() resumes from after a restart.
     """
-    global auto_responding, last_checked_timestamps, processed_message_ids, all_threads
-    chat = model.start_chat(history=[])
-    while True:
+    work_queue = None
+    polled_at = None
+    if THREAD_WORKERS > 1:
+        limits = dict({"regular": THREAD_WORKERS - 1}, **PRIORITY_CONCURRENCY)
+        work_queue = PriorityWorkQueue(PRIORITY_CLASSES, workers=THREAD_WORKERS, limits=limits, metrics=metrics)
+    while stop is None or not stop.is_set():
+        # While Instagram is throttling us, stop polling altogether until the circuit breaker lets a probe through
+        if guard.breaker.is_open():
+            pause = guard.breaker.retry_in()
+            print(f"Polling paused for {pause:.0f}s while Instagram recovers (last error: {guard.breaker.last_error})")
+            if stop is None:
+                time.sleep(pause)
+            else:
+                stop.wait(pause)
+            continue
+        cycle_started_at = datetime.now()
         try:
+            if guard.login_required:
+                print("Instagram asked us to log in again")
+                login(fresh=True)
             # Fetch recent threads
-            threads = cl.direct_threads(amount=THREAD_FETCH_AMOUNT)
-            for thread in threads:
-                thread_id = thread.id
-                # Initialize auto-response state for new threads
-                if thread_id not in auto_responding:
-                    auto_responding[thread_id] = True
-                # Initialize thread information storage
-                if thread_id not in all_threads:
-                    all_threads[thread_id] = {"users": [user.username for user in thread.users], "messages": []}
-                last_timestamp = last_checked_timestamps.get(thread_id, start_time)
-
-                # Fetch messages in the current thread
-                messages = cl.direct_messages(thread_id, amount=MESSAGE_FETCH_AMOUNT)
-                # Store new messages in all_threads for history
-                for msg in messages:
-                    if msg.timestamp > start_time and msg.id not in [m["id"] for m in all_threads[thread_id]["messages"]]:
-                        try:
-                            msg_sender_username = cl.user_info_v1(str(msg.user_id)).username
-                        except Exception as e:
-                            print(f"Error fetching username for message {msg.id} in thread {thread_id}: {e}")
-                            msg_sender_username = "UnknownUser"
-                        all_threads[thread_id]["messages"].append({
-                            "id": msg.id,
-                            "user_id": msg.user_id,
-                            "username": msg_sender_username,
-                            "text": msg.text,
-                            "timestamp": msg.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-                        })
-
-                # Filter for messages newer than the last checked timestamp
-                new_messages = [msg for msg in messages if msg.timestamp > last_timestamp]
-                if not new_messages:
-                    print(f"No new messages in thread {thread_id}")
-                    continue
-
-                for message in new_messages:
-                    message_id = message.id
-                    # processed_message_ids: A set to keep track of message IDs that have already been processed to avoid duplication.
-                    if message_id in processed_message_ids:
-                        print(f"Skipping already processed message {message_id} in thread {thread_id}")
-                        continue
-
-                    # Ignore bot's own messages to prevent self-reply loops.
-                    if str(message.user_id) == str(bot_id):
-                        print(f"Ignoring bot's own message {message_id} in thread {thread_id}: {message.text}")
-                        continue
-
-                    message_text = message.text
-                    sender_id = message.user_id
-                    try:
-                        sender_info = cl.user_info_v1(str(sender_id))
-                        sender_username = sender_info.username
-                        sender_full_name = sender_info.full_name
-                        sender_follower_count = sender_info.follower_count
-                    except Exception as e:
-                        print(f"Error fetching sender info for user ID {sender_id} in thread {thread_id}: {e}")
-                        # Fallback values if sender info cannot be fetched
-                        sender_username = "UnknownUser"
-                        sender_full_name = "Unknown User"
-                        sender_follower_count = 0 # Default follower count
-                        # Optionally, skip this message if sender info is critical
-                        # print(f"Skipping message {message_id} due to sender info fetch failure.")
-                        # continue 
-                    timestamp = message.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-
-                    # If auto-response is paused for this thread, check if the message is a command to resume.
-                    if not auto_responding[thread_id]:
-                        print(f"{time.ctime()} - Auto-response paused for thread {thread_id}, checking for resume command")
-                        if message_text and any(keyword in message_text.lower() for keyword in ["resume", "start", "enable", "unpause", "continue"]):
-                            auto_responding[thread_id] = True
-                            cl.direct_send("Auto-response resumed for this thread.", [thread.users[0].pk])
-                            print(f"Auto-response resumed in thread {thread_id}")
-                            processed_message_ids.add(message_id)
-                        continue
-                    
-                    # Send an initial acknowledgment to the user.
-                    print(f"New DM in thread {thread_id} from {sender_username}: {message_text}")
-                    cl.direct_send("request acknowledged. Please wait for Raphael to respond....", [thread.users[0].pk])
-                    print(f"Sent acknowledgment to {thread.users[0].pk} in thread {thread_id}")
-
-                    # Construct conversation history for the prompt, including past messages from the user and the bot.
-                    conversation_history = []
-                    for msg in messages:
-                        if msg.timestamp > start_time and (msg.user_id == sender_id or str(msg.user_id) == str(bot_id)):
-                            role = "User" if msg.user_id == sender_id else "Raphael"
-                            conversation_history.append(f"{role}: {msg.text}")
-
-                    history_text = "\n".join(conversation_history)
-
-                    prompt_first = PROMPT_FIRST_TEMPLATE.format(
-                        bot_username_in_context=cl.username,
-                        owner_username=OWNER_USERNAME,
-                        current_date=datetime.now().strftime('%Y-%m-%d'),
-                        sender_username=sender_username,
-                        thread_id=thread_id,
-                        sender_full_name=sender_full_name,
-                        timestamp=timestamp,
-                        sender_follower_count=sender_follower_count,
-                        history_text=history_text,
-                        message_text=message_text
-                    )
-                    try:
-                        print(f"Sending first request to Gemini API for thread {thread_id}")
-                        response_first = chat.send_message(prompt_first)
-                        print(f"First response parts: {response_first.parts}")
-                    except Exception as e:
-                        print(f"Error sending first request to Gemini API for thread {thread_id}, message {message_id}: {e}")
-                        processed_message_ids.add(message_id) # Mark as processed to avoid retrying indefinitely
-                        continue # Skip to the next message
-
-                    function_triggered = False
-                    function_name = None
-                    function_message = None
-                    target_thread_id = None
-                    message_sent_successfully = False
-                    sent_to_users = []
-                    failed_to_users = []
-                    fetched_data = None
-                    args_for_prompt = {} # Define args_for_prompt to ensure it's available
-
-                    for part in response_first.parts:
-                        if part.function_call:
-                            function_triggered = True
-                            func_call = part.function_call
-                            function_name = func_call.name
-                            args_for_prompt = func_call.args # Store args for later use in prompt_second
-                            # Handle 'notify_owner' function call: Send a message to the bot owner.
-                            if func_call.name == "notify_owner":
-                                args = func_call.args
-                                message_content = args["message"]
-                                # Replace placeholders in the message content before sending
-                                formatted_message_content = format_message(
-                                    message_content,
-                                    thread_id=str(args.get("thread_id", thread_id)),
-                                    sender_username=args.get("sender_username", sender_username),
-                                    sender_full_name=args.get("sender_full_name", sender_full_name),
-                                    timestamp=args.get("timestamp", timestamp),
-                                    sender_follower_count=str(args.get("sender_follower_count", sender_follower_count)),
-                                    owner_username=OWNER_USERNAME
-                                )
-                                function_message = formatted_message_content # For the second prompt
-                                send_message_to_owner(
-                                    formatted_message_content,
-                                    args.get("thread_id", thread_id),
-                                    args.get("sender_username", sender_username),
-                                    args.get("sender_full_name", sender_full_name),
-                                    args.get("timestamp", timestamp),
-                                    args.get("sender_follower_count", sender_follower_count)
-                                )
-                                print(f"Elevated awareness in thread {thread_id}")
-                            # Handle 'pause_auto_response' function call: Pause auto-responses for the current thread.
-                            elif func_call.name == "pause_auto_response":
-                                auto_responding[thread_id] = False
-                                print(f"Auto-response paused in thread {thread_id}")
-                            # Handle 'resume_auto_response' function call: Resume auto-responses for the current thread.
-                            elif func_call.name == "resume_auto_response":
-                                auto_responding[thread_id] = True
-                                print(f"Auto-response resumed in thread {thread_id}")
-                            # Handle 'target_thread' function call: Change focus to a different thread (owner only).
-                            elif func_call.name == "target_thread" and sender_username == OWNER_USERNAME:
-                                args = func_call.args
-                                target_thread_id = args.get("thread_id")
-                                target_username = args.get("target_username")
-                                if target_thread_id:
-                                    print(f"Targeting thread {target_thread_id} as requested by {OWNER_USERNAME}")
-                                elif target_username:
-                                    for t in cl.direct_threads(amount=MESSAGE_FETCH_AMOUNT): # Use configured amount
-                                        if any(user.username == target_username for user in t.users):
-                                            target_thread_id = t.id
-                                            print(f"Targeting thread {target_thread_id} with username {target_username} as requested by {OWNER_USERNAME}")
-                                            break
-                                    if not target_thread_id:
-                                        print(f"No thread found with username {target_username}")
-                            # Handle 'send_message' function call: Send a message to a specified user or thread.
-                            elif func_call.name == "send_message":
-                                args = func_call.args
-                                message_to_send = args["message"] # Renamed to avoid conflict
-                                target_username = args.get("target_username")
-                                target_thread_id_func_arg = args.get("thread_id")
-                                try:
-                                    if target_thread_id_func_arg:
-                                        cl.direct_send(message_to_send, thread_ids=[target_thread_id_func_arg])
-                                        print(f"Sent message '{message_to_send}' to thread {target_thread_id_func_arg}")
-                                        message_sent_successfully = True
-                                    elif target_username:
-                                        target_usernames = [u.strip() for u in target_username.split(",")]
-                                        for username_to_send in target_usernames:
-                                            try:
-                                                user_id = cl.user_id_from_username(username_to_send)
-                                            except Exception as e:
-                                                print(f"Failed to get user ID for username {username_to_send}: {e}")
-                                                failed_to_users.append(username_to_send)
-                                                continue # Skip this username
-                                            try:
-                                                cl.direct_send(message_to_send, [user_id])
-                                                sent_to_users.append(username_to_send)
-                                                print(f"Sent message '{message_to_send}' to {username_to_send}")
-                                            except Exception as e:
-                                                failed_to_users.append(username_to_send)
-                                                print(f"Failed to send message to {username_to_send} (ID: {user_id}): {e}")
-                                        message_sent_successfully = len(sent_to_users) > 0
-                                    else:
-                                        cl.direct_send(message_to_send, [thread.users[0].pk])
-                                        print(f"Sent message '{message_to_send}' to current thread {thread_id}")
-                                        message_sent_successfully = True
-                                except Exception as e:
-                                    print(f"Failed to send message: {e}")
-                                    message_sent_successfully = False
-                            # Handle 'list_threads' function call: List all active threads (owner only).
-                            elif func_call.name == "list_threads" and sender_username == OWNER_USERNAME:
-                                thread_list = "\n".join([f"Thread {tid}: Users: {', '.join(info['users'])}" for tid, info in all_threads.items()])
-                                function_message = f"Here are all active threads:\n{thread_list}"
-                            # Handle 'view_dms' function call: View DMs in a specific thread (owner only).
-                            elif func_call.name == "view_dms" and sender_username == OWNER_USERNAME:
-                                args = func_call.args
-                                view_thread_id = args.get("thread_id", thread_id)
-                                if view_thread_id in all_threads:
-                                    dms = "\n".join([f"{m['timestamp']} - {m['username']}: {m['text']}" for m in all_threads[view_thread_id]["messages"]])
-                                    function_message = f"Past DMs in thread {view_thread_id}:\n{dms}"
-                                else:
-                                    function_message = f"No DMs found for thread {view_thread_id}"
-                            # Handle 'fetch_followers_followings' function call: Get follower/following lists.
-                            elif func_call.name == "fetch_followers_followings":
-                                args = func_call.args
-                                target_username_fetch = args["target_username"] 
-                                max_count = args.get("max_count", 50) # Default to 50 if not specified
-                                try:
-                                    user_id = cl.user_id_from_username(target_username_fetch)
-                                    followers = cl.user_followers(user_id, amount=max_count)
-                                    followings = cl.user_following(user_id, amount=max_count)
-                                    followers_usernames = [cl.user_info_v1(str(uid)).username for uid in followers.keys()]
-                                    followings_usernames = [cl.user_info_v1(str(uid)).username for uid in followings.keys()]
-                                    fetched_data = f"Followers of {target_username_fetch} (up to {max_count}): {', '.join(followers_usernames)}\n" \
-                                                  f"Followings of {target_username_fetch} (up to {max_count}): {', '.join(followings_usernames)}"
-                                    print(f"Fetched followers and followings for {target_username_fetch}")
-                                except Exception as e:
-                                    fetched_data = f"Failed to fetch data for {target_username_fetch}: {str(e)}"
-                                    print(f"Error fetching followers/followings: {e}")
-                        elif part.text:
-                            # If no function call, send the model's text response directly to the user.
-                            reply = format_message(
-                                part.text.strip(),
-                                thread_id=str(thread_id),
-                                sender_username=sender_username,
-                                sender_full_name=sender_full_name,
-                                timestamp=timestamp,
-                                sender_follower_count=str(sender_follower_count),
-                                owner_username=OWNER_USERNAME
-                            )
-                            cl.direct_send(reply, [thread.users[0].pk])
-                            print(f"Responded to {thread.users[0].pk} in thread {thread_id} with: {reply}")
-
-                    # If a function was triggered, send a second request to the API to explain the action to the user.
-                    if function_triggered:
-                        function_message_placeholder = ""
-                        if function_name == "notify_owner":
-                            function_message_placeholder = f"The message sent to my owner was: {function_message}"
-
-                        target_thread_placeholder = ""
-                        if function_name == "target_thread" and target_thread_id:
-                            target_thread_placeholder = f"I am now targeting thread {target_thread_id} as requested."
-
-                        send_message_placeholder = ""
-                        if function_name == "send_message":
-                            sent_msg_content = args_for_prompt.get('message', 'Unknown')
-                            sent_to_str = ', '.join(sent_to_users) if sent_to_users else 'None'
-                            failed_to_str = ', '.join(failed_to_users) if failed_to_users else 'None'
-                            send_message_placeholder = f"I attempted to send the message: {sent_msg_content} - Successfully sent to: {sent_to_str}, Failed to send to: {failed_to_str}"
-
-                        list_or_view_dms_placeholder = ""
-                        if function_name in ["list_threads", "view_dms"]:
-                            list_or_view_dms_placeholder = f"Here’s the result: {function_message}"
-                        
-                        fetched_data_placeholder = ""
-                        if function_name == "fetch_followers_followings":
-                            fetched_data_placeholder = f"Here’s the fetched data: {fetched_data}"
-
-                        prompt_second = PROMPT_SECOND_TEMPLATE.format(
-                            bot_username_in_context=cl.username,
-                            sender_username=sender_username,
-                            message_text=message_text,
-                            thread_id=thread_id,
-                            function_name=function_name,
-                            function_message_placeholder=function_message_placeholder,
-                            target_thread_placeholder=target_thread_placeholder,
-                            send_message_placeholder=send_message_placeholder,
-                            list_or_view_dms_placeholder=list_or_view_dms_placeholder,
-                            fetched_data_placeholder=fetched_data_placeholder,
-                            sender_full_name=sender_full_name, # Added missing placeholder
-                            timestamp=timestamp,
-                            sender_follower_count=sender_follower_count,
-                            owner_username=OWNER_USERNAME
-                        )
-                        try:
-                            print(f"Sending second request to Gemini API for thread {thread_id}")
-                            response_second = chat.send_message(prompt_second)
-                            print(f"Second response parts: {response_second.parts}")
-
-                            for part in response_second.parts:
-                                if part.text:
-                                    user_reply = format_message(
-                                        part.text.strip(),
-                                        thread_id=str(thread_id),
-                                        sender_username=sender_username,
-                                        sender_full_name=sender_full_name,
-                                        timestamp=timestamp,
-                                        sender_follower_count=str(sender_follower_count),
-                                        owner_username=OWNER_USERNAME
-                                    )
-                                    cl.direct_send(user_reply, [thread.users[0].pk])
-                                    print(f"Responded to {thread.users[0].pk} in thread {thread_id} with: {user_reply}")
-                                else:
-                                    print(f"No text reply in second response for thread {thread_id}")
-                        except Exception as e:
-                            print(f"Error sending second request to Gemini API or processing its response for thread {thread_id}, message {message_id}: {e}")
-                            # message_id is already added to processed_message_ids before the first API call, 
-                            # or will be added after this block if the first call succeeded.
-                            # No need to send a message to user here as the interaction is already complex.
-                    
-                    # Mark the message as processed (if not already marked due to API error)
-                    processed_message_ids.add(message_id)
-
-                # Update the last checked timestamp for the thread
-                if messages:
-                    last_checked_timestamps[thread_id] = max(msg.timestamp for msg in messages)
+            with metrics.timed("direct_threads"):
+                threads = cl.direct_threads(amount=THREAD_FETCH_AMOUNT)
+            # Without incremental sync every check costs a request, so cold threads are checked less often
+            threads = [thread for thread in threads if INCREMENTAL_SYNC or scheduler.should_check(thread.id)]
+            # Sorting is stable, so threads within a class keep the inbox order
+            prioritized = sorted(((thread_priority(thread), thread) for thread in threads), key=lambda entry: PRIORITY_CLASSES.index(entry[0]))
+            for priority_class, thread in prioritized:
+                if work_queue is None:
+                    with metrics.timed("work", priority=priority_class):
+                        process_thread(thread)
+                elif not work_queue.submit(thread.id, priority_class, process_thread, thread):
+                    print(f"Thread {thread.id} is already queued or being processed")
+            if work_queue is None:
+                polled_at = cycle_started_at
+            else:
+                # The threads queued this cycle may still be waiting, so it only counts once they have all finished
+                work_queue.checkpoint(cycle_started_at)
 
         except Exception as e:
             print(f"Error in auto_respond: {e}")
-        # Random sleep to mimic human behavior and avoid rate limiting
-        sleep_time = random.randint(MIN_SLEEP_TIME, MAX_SLEEP_TIME)
-        print("sleeping for ", sleep_time, " seconds")
-        time.sleep(sleep_time)
+        if work_queue is not None:
+            polled_at = work_queue.reached() or polled_at
+        if state_store is not None:
+            # Everything queued this cycle is committed in one transaction
+            try:
+                if polled_at is not None:
+                    state_store.set_meta("last_poll_at", polled_at.timestamp())
+                state_store.flush()
+            except Exception as e:
+                print(f"Failed to save state: {e}")
+        print(f"Profile cache: {profile_cache.stats()}, chat sessions: {chat_sessions.stats()}, outbox: {outbox.stats()}, client: {guard.stats()}")
+        if work_queue is not None:
+            print(f"Work queue: {work_queue.stats()}")
+        if response_cache is not None:
+            print(f"Response cache: {response_cache.stats()}")
+        metrics.observe("cycle_seconds", (datetime.now() - cycle_started_at).total_seconds())
+        metrics.inc("cycles_total")
+        metrics.set_gauge("threads_tracked", len(all_threads))
+        metrics.set_gauge("threads_in_flight", work_queue.pending() if work_queue else 0)
+        metrics.set_gauge("outbox_queued", outbox.pending())
+        metrics.set_gauge("profile_cache_hit_rate", profile_cache.hit_rate)
+        metrics.set_gauge("poll_interval_seconds", scheduler.interval)
+        metrics.set_gauge("circuit_open", int(guard.breaker.is_open()))
+        # Poll quickly while conversations are active and back off (with jitter) when idle to avoid rate limiting
+        sleep_time = scheduler.end_cycle()
+        print(f"sleeping for {sleep_time:.1f} seconds ({scheduler.last_decision})")
+        if stop is None:
+            time.sleep(sleep_time)
+        else:
+            stop.wait(sleep_time)
+    if work_queue is not None:
+        work_queue.shutdown(wait=True)
+        if state_store is not None and work_queue.reached() is not None:
+            state_store.set_meta("last_poll_at", work_queue.reached().timestamp())
+
+def shutdown():
+    """Sends what is still queued and saves the session and state; called once the poll loop has stopped."""
+    outbox.stop()
+    save_login_session()  # Keeps the cookies Instagram refreshed during the run
+    if state_store is not None:
+        state_store.close()
+    if recorder is not None:
+        recorder.close()
 
 def e_exit(signum, frame):
     """Handles graceful shutdown on SIGINT (Ctrl+C)."""
     print("\nShutting down...")
+    shutdown()
     exit(0)
 
+def run(stop=None):
+    """Logs in, restores the saved state and runs the poll loop until `stop` is set; returns False if login fails."""
+    if not login():
+        return False
+    load_state()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+        print(f"Serving metrics on port {METRICS_PORT}")
+    if METRICS_SNAPSHOT_PATH:
+        metrics.start_snapshots(METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL)
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    metrics.set_gauge("startup_seconds", time.perf_counter() - boot_started_at)
+    print(f"Starting auto-responder {time.perf_counter() - boot_started_at:.2f}s after start-up...")
+    auto_respond(stop)
+    return True
+
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, e_exit)
-    if not login():
+    if not run():
         exit()
-    print_user_info()
-    print("Starting auto-responder...")
-    auto_respond()
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Runs the auto-responder for several Instagram accounts at once, one worker process
+per account. Accounts are listed in the JSON file at ACCOUNTS_PATH:
+
+    [
+        {"name": "main", "SESSION_ID": "...", "OWNER_USERNAME": "..."},
+        {"name": "support", "SESSION_ID": "...", "OWNER_USERNAME": "...", "THREAD_WORKERS": "4"}
+    ]
+
+Every key besides "name" overrides the setting of the same name from .env for that
+account. Run it from the repository root:
+
+    python accounts.py
+"""
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from queue import Empty
+
+# Settings that would collide between accounts, so they are off unless an account sets them
+UNSHARED_SETTINGS = {"METRICS_PORT": "0", "METRICS_SNAPSHOT_PATH": "", "RECORD_TRAFFIC_PATH": ""}
+
+
+def account_path(path, name):
+    """Gives each account its own copy of a file setting, e.g. aetherion_state.db -> aetherion_state_main.db."""
+    if not path:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}_{name}{extension}"
+
+
+def load_accounts(path, state_db_path, session_settings_path):
+    """Reads the account list and returns (name, environment overrides) for each account."""
+    with open(path) as accounts_file:
+        entries = json.load(accounts_file)
+    accounts = []
+    names = set()
+    for entry in entries:
+        name = entry.get("name")
+        if not name or name in names:
+            raise ValueError(f"Every account in {path} needs a unique name (got {name!r})")
+        if not entry.get("SESSION_ID") or not entry.get("OWNER_USERNAME"):
+            raise ValueError(f"Account {name} in {path} needs a SESSION_ID and an OWNER_USERNAME")
+        names.add(name)
+        environment = dict(UNSHARED_SETTINGS)
+        environment["STATE_DB_PATH"] = account_path(state_db_path, name)
+        environment["SESSION_SETTINGS_PATH"] = account_path(session_settings_path, name)
+        environment.update({key: str(value) for key, value in entry.items() if key != "name"})
+        accounts.append((name, environment))
+    return accounts
+
+
+def run_account(name, environment, reports, stop, report_interval):
+    """Worker process: runs one account's poll loop until `stop` is set, reporting its metrics every `report_interval` seconds."""
+    # Ctrl+C reaches every process in the group; the supervisor stops the workers through `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Settings are read when config is first imported, so the account's overrides go in before that
+    os.environ.update(environment)
+    import Main
+
+    def report():
+        while not stop.wait(report_interval):
+            reports.put((name, Main.metrics.snapshot()))
+
+    threading.Thread(target=report, name="account-report", daemon=True).start()
+    try:
+        if not Main.run(stop):
+            raise SystemExit(1)
+    finally:
+        Main.shutdown()
+        reports.put((name, Main.metrics.snapshot()))
+
+
+def counter_total(snapshot, name):
+    """Sums a counter over all of its labels."""
+    return sum(value for key, value in snapshot["counters"].items() if key == name or key.startswith(name + "{"))
+
+
+class AccountStats:
+    """Throughput and error figures for one account, from the metrics snapshots its worker reports."""
+
+    def __init__(self, name):
+        self.name = name
+        self.restarts = 0
+        self.snapshot = None
+        self.previous = None
+        self.reported_at = None
+        self.previous_at = None
+
+    def update(self, snapshot):
+        self.previous, self.previous_at = self.snapshot, self.reported_at
+        self.snapshot, self.reported_at = snapshot, time.monotonic()
+
+    def summary(self):
+        if self.snapshot is None:
+            return f"[{self.name}] no report yet, {self.restarts} restarts"
+        handled = counter_total(self.snapshot, "messages_handled_total")
+        rate = 0.0
+        if self.previous is not None and self.reported_at > self.previous_at:
+            rate = (handled - counter_total(self.previous, "messages_handled_total")) / (self.reported_at - self.previous_at) * 60
+        return (
+            f"[{self.name}] {handled} messages ({rate:.1f}/min), "
+            f"{counter_total(self.snapshot, 'errors_total')} errors, "
+            f"{counter_total(self.snapshot, 'rate_limit_hits_total')} rate-limit hits, "
+            f"{counter_total(self.snapshot, 'llm_calls_total')} Gemini calls, "
+            f"{counter_total(self.snapshot, 'llm_prompt_tokens_total')} prompt tokens, "
+            f"{self.restarts} restarts"
+        )
+
+
+class AccountSupervisor:
+    """
+    Starts a worker process per account, restarts workers that exit on their own after
+    `restart_delay` seconds, and prints each account's stats every `report_interval` seconds.
+    """
+
+    def __init__(self, accounts, report_interval=60, restart_delay=30):
+        self.accounts = dict(accounts)
+        self.report_interval = report_interval
+        self.restart_delay = restart_delay
+        # Workers are spawned rather than forked so each one reads its own settings on import
+        self.context = multiprocessing.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.stop = self.context.Event()
+        self.processes = {}
+        self.restart_at = {}
+        self.stats = {name: AccountStats(name) for name in self.accounts}
+
+    def start(self, name):
+        process = self.context.Process(
+            target=run_account,
+            args=(name, self.accounts[name], self.reports, self.stop, self.report_interval),
+            name=f"account-{name}",
+        )
+        process.start()
+        self.processes[name] = process
+        print(f"Started account {name} (pid {process.pid})")
+
+    def check_workers(self):
+        now = time.monotonic()
+        for name, process in self.processes.items():
+            if process.is_alive() or name in self.restart_at:
+                continue
+            print(f"Account {name} exited with code {process.exitcode}, restarting in {self.restart_delay:.0f}s")
+            self.restart_at[name] = now + self.restart_delay
+        for name, restart_at in list(self.restart_at.items()):
+            if now >= restart_at:
+                del self.restart_at[name]
+                self.stats[name].restarts += 1
+                self.start(name)
+
+    def drain_reports(self, timeout):
+        try:
+            name, snapshot = self.reports.get(timeout=timeout)
+            self.stats[name].update(snapshot)
+            while True:
+                name, snapshot = self.reports.get_nowait()
+                self.stats[name].update(snapshot)
+        except Empty:
+            pass
+
+    def print_stats(self):
+        for name in self.accounts:
+            print(self.stats[name].summary())
+
+    def run(self):
+        for name in self.accounts:
+            self.start(name)
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while True:
+                self.drain_reports(timeout=1.0)
+                self.check_workers()
+                if time.monotonic() >= next_report:
+                    self.print_stats()
+                    next_report += self.report_interval
+        except KeyboardInterrupt:
+            print("\nShutting down all accounts...")
+        finally:
+            self.stop.set()
+            # Workers only exit once their last reports have been read from the queue
+            while any(process.is_alive() for process in self.processes.values()):
+                self.drain_reports(timeout=0.5)
+            for process in self.processes.values():
+                process.join()
+            self.drain_reports(timeout=0.1)
+            self.print_stats()
+
+
+def main():
+    from config import ACCOUNTS_PATH, ACCOUNT_REPORT_INTERVAL, ACCOUNT_RESTART_DELAY, STATE_DB_PATH, SESSION_SETTINGS_PATH
+
+    accounts = load_accounts(ACCOUNTS_PATH, STATE_DB_PATH, SESSION_SETTINGS_PATH)
+    print(f"Running {len(accounts)} accounts from {ACCOUNTS_PATH}")
+    AccountSupervisor(accounts, report_interval=ACCOUNT_REPORT_INTERVAL, restart_delay=ACCOUNT_RESTART_DELAY).run()
+
+
+if __name__ == "__main__":
+    main()
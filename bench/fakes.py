@@ -0,0 +1,325 @@
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+ACKNOWLEDGMENT_PREFIX = "request acknowledged"
+
+
+class FakeClientError(Exception):
+    pass
+
+
+class ClientThrottledError(FakeClientError):
+    """Named like instagrapi's throttling error so it is classified as a rate-limit hit."""
+
+
+class FakeModelError(Exception):
+    pass
+
+
+class FakeUser:
+    __slots__ = ("pk", "username", "full_name", "follower_count", "biography")
+
+    def __init__(self, pk, username, follower_count=0):
+        self.pk = str(pk)
+        self.username = username
+        self.full_name = username.replace("_", " ").title()
+        self.follower_count = follower_count
+        self.biography = ""
+
+
+class FakeMessage:
+    __slots__ = ("id", "user_id", "thread_id", "text", "timestamp")
+
+    def __init__(self, id, user_id, thread_id, text, timestamp):
+        self.id = id
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.text = text
+        self.timestamp = timestamp
+
+
+class FakeThread:
+    __slots__ = ("id", "users", "messages")
+
+    def __init__(self, id, users, messages):
+        self.id = id
+        self.users = users
+        self.messages = messages  # newest first, like instagrapi
+
+
+class FakeInstagram:
+    """
+    In-process stand-in for instagrapi's Client, with one one-to-one thread per fake user.
+    User messages arrive as a Poisson process at `arrival_rate` messages per second,
+    spread across the threads at random. Every call sleeps for about `latency`
+    seconds and fails with probability `failure_rate` (or is throttled with
+    probability `throttle_rate`). Replies sent back to a thread are matched with the
+    messages waiting in it to measure end-to-end reply latency.
+    """
+
+    def __init__(self, threads=20, arrival_rate=2.0, latency=0.05, failure_rate=0.0, throttle_rate=0.0,
+                 inline_messages=5, owner_username="owner", seed=None):
+        self.random = random.Random(seed)
+        self.arrival_rate = arrival_rate
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.inline_messages = inline_messages
+        self.user_id = "1000"
+        self.username = "fake_bot"
+        self.bot = FakeUser(self.user_id, self.username)
+        self.owner = FakeUser("999", owner_username)
+        self.users = {self.bot.pk: self.bot, self.owner.pk: self.owner}
+        self.threads = {}  # thread_id -> list of FakeMessages, oldest first
+        self.thread_users = {}  # thread_id -> [FakeUser]
+        for index in range(threads):
+            user = FakeUser(2000 + index, f"user_{index}", follower_count=self.random.randint(0, 5000))
+            self.users[user.pk] = user
+            self.threads[f"340{index:05d}"] = []
+            self.thread_users[f"340{index:05d}"] = [user]
+        self.calls = Counter()
+        self.injected_failures = 0
+        self.arrived = 0
+        self.answered = 0
+        self.owner_notifications = 0
+        self.reply_latencies = []
+        self._waiting = {thread_id: [] for thread_id in self.threads}  # thread_id -> arrival times of unanswered messages
+        self._seen_until = {thread_id: 0.0 for thread_id in self.threads}  # thread_id -> arrival time of the newest message returned to the bot
+        self._generating = True
+        self._next_arrival = time.time() + self._interarrival()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _interarrival(self):
+        return self.random.expovariate(self.arrival_rate) if self.arrival_rate > 0 else float("inf")
+
+    def _call(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+            roll = self.random.random()
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            if roll < self.throttle_rate + self.failure_rate:
+                self.injected_failures += 1
+        time.sleep(delay)
+        if roll < self.throttle_rate:
+            raise ClientThrottledError(f"Fake {endpoint} throttled")
+        if roll < self.throttle_rate + self.failure_rate:
+            raise FakeClientError(f"Fake {endpoint} failure")
+
+    def _add_message(self, thread_id, user_id, text, at):
+        message = FakeMessage(str(self._next_id), user_id, thread_id, text, datetime.fromtimestamp(at))
+        self._next_id += 1
+        self.threads[thread_id].append(message)
+        return message
+
+    def _deliver_arrivals(self):
+        """Adds every user message scheduled to arrive by now."""
+        now = time.time()
+        thread_ids = list(self.threads)
+        while self._generating and self._next_arrival <= now:
+            thread_id = self.random.choice(thread_ids)
+            user = self.thread_users[thread_id][0]
+            self._add_message(thread_id, user.pk, f"Hello, this is message {self.arrived + 1} from {user.username}. Can you help me?", self._next_arrival)
+            self._waiting[thread_id].append(self._next_arrival)
+            self.arrived += 1
+            self._next_arrival += self._interarrival()
+
+    def stop_arrivals(self):
+        with self._lock:
+            self._deliver_arrivals()
+            self._generating = False
+
+    def unanswered(self):
+        with self._lock:
+            return sum(len(waiting) for waiting in self._waiting.values())
+
+    def login_by_sessionid(self, sessionid):
+        self._call("login_by_sessionid")
+        return True
+
+    def direct_threads(self, amount=20, **kwargs):
+        self._call("direct_threads")
+        with self._lock:
+            self._deliver_arrivals()
+            by_activity = sorted(self.threads, key=lambda tid: self.threads[tid][-1].timestamp if self.threads[tid] else datetime.min, reverse=True)
+            return [
+                FakeThread(thread_id, list(self.thread_users[thread_id]), self._returned(thread_id, self.inline_messages))
+                for thread_id in by_activity[:amount]
+            ]
+
+    def direct_messages(self, thread_id, amount=20):
+        self._call("direct_messages")
+        with self._lock:
+            return self._returned(str(thread_id), amount)
+
+    def _returned(self, thread_id, amount):
+        """Returns the newest messages of a thread, newest first, and remembers that the bot has seen them."""
+        messages = self.threads[thread_id][-amount:][::-1] if amount else []
+        if messages:
+            self._seen_until[thread_id] = max(self._seen_until[thread_id], messages[0].timestamp.timestamp())
+        return messages
+
+    def direct_send(self, text, user_ids=None, thread_ids=None):
+        self._call("direct_send")
+        now = time.time()
+        with self._lock:
+            targets = [str(thread_id) for thread_id in thread_ids or []]
+            for user_id in user_ids or []:
+                if str(user_id) == self.owner.pk:
+                    self.owner_notifications += 1
+                else:
+                    targets.extend(tid for tid, users in self.thread_users.items() if users[0].pk == str(user_id))
+            message = None
+            for thread_id in targets:
+                message = self._add_message(thread_id, self.user_id, text, now)
+                # The acknowledgment is not an answer, and a reply only answers messages the bot has already fetched
+                if text.startswith(ACKNOWLEDGMENT_PREFIX):
+                    continue
+                answered = [arrived_at for arrived_at in self._waiting[thread_id] if arrived_at <= self._seen_until[thread_id] + 1e-6]  # timestamps keep microseconds
+                if answered:
+                    self.reply_latencies.extend(now - arrived_at for arrived_at in answered)
+                    self.answered += len(answered)
+                    self._waiting[thread_id] = self._waiting[thread_id][len(answered):]
+            return message
+
+    def user_info_v1(self, user_id):
+        self._call("user_info_v1")
+        return self.users[str(user_id)]
+
+    def user_info_by_username_v1(self, username):
+        self._call("user_info_by_username_v1")
+        return next(user for user in self.users.values() if user.username == username)
+
+    def user_id_from_username(self, username):
+        self._call("user_id_from_username")
+        return next(user.pk for user in self.users.values() if user.username == username)
+
+    def _follow_chunk(self, endpoint, user_id, max_amount, max_id):
+        self._call(endpoint)
+        people = sorted(self.users.values(), key=lambda user: user.pk)
+        start = int(max_id or 0)
+        page = people[start:start + max_amount]
+        return page, str(start + len(page)) if start + len(page) < len(people) else ""
+
+    def user_followers_v1_chunk(self, user_id, max_amount=0, max_id=""):
+        return self._follow_chunk("user_followers_v1_chunk", user_id, max_amount, max_id)
+
+    def user_following_v1_chunk(self, user_id, max_amount=0, max_id=""):
+        return self._follow_chunk("user_following_v1_chunk", user_id, max_amount, max_id)
+
+
+class FakeFunctionCall:
+    __slots__ = ("name", "args")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+class FakePart:
+    __slots__ = ("text", "function_call")
+
+    def __init__(self, text="", function_call=None):
+        self.text = text
+        self.function_call = function_call
+
+
+class FakeContent:
+    __slots__ = ("role", "parts")
+
+    def __init__(self, role, parts):
+        self.role = role
+        self.parts = parts
+
+
+class FakeUsage:
+    __slots__ = ("prompt_token_count", "candidates_token_count", "cached_content_token_count", "total_token_count")
+
+    def __init__(self, prompt_token_count, candidates_token_count, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    __slots__ = ("parts", "usage_metadata")
+
+    def __init__(self, parts, usage_metadata=None):
+        self.parts = parts
+        self.usage_metadata = usage_metadata
+
+
+class FakeGenerativeModel:
+    """
+    In-process stand-in for genai.GenerativeModel. Each request sleeps for about
+    `latency` seconds and fails with probability `failure_rate`. A first request
+    asks for a notify_owner call with probability `function_call_rate`; otherwise
+    the reply is plain text of about `reply_chars` characters.
+    """
+
+    def __init__(self, latency=0.8, failure_rate=0.0, function_call_rate=0.1, reply_chars=200, system_instruction="", seed=None):
+        self.random = random.Random(seed)
+        self.system_instruction = system_instruction
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.function_call_rate = function_call_rate
+        self.reply_chars = reply_chars
+        self.calls = 0
+        self.prompt_chars = 0
+        self.injected_failures = 0
+        self._lock = threading.Lock()
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+    def usage(self, prompt, parts, history):
+        """Token counts the way Gemini reports them: the whole chat history is part of every prompt."""
+        history_chars = sum(len(part.text or "") for content in history for part in content.parts)
+        output_chars = sum(len(part.text or "") for part in parts)
+        return FakeUsage((len(self.system_instruction) + history_chars + len(prompt)) // 4 + 1, output_chars // 4 + 1)
+
+    def respond(self, prompt):
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+            roll = self.random.random()
+            call_roll = self.random.random()
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            if roll < self.failure_rate:
+                self.injected_failures += 1
+        time.sleep(delay)
+        if roll < self.failure_rate:
+            raise FakeModelError("Fake model failure")
+        if call_roll < self.function_call_rate and "I just executed" not in prompt:
+            return [FakePart(function_call=FakeFunctionCall("notify_owner", {"message": "A user asked for the owner's attention."}))]
+        sentence = "Greetings, [[sender_username]]. I have noted your message and will see to it. "
+        return [FakePart(text=(sentence * (self.reply_chars // len(sentence) + 1))[:self.reply_chars])]
+
+
+class FakeChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, prompt, stream=False):
+        parts = self.model.respond(prompt)
+        usage = self.model.usage(prompt, parts, self.history)
+        self.history.append(FakeContent("user", [FakePart(text=prompt)]))
+        self.history.append(FakeContent("model", parts))
+        if not stream:
+            return FakeResponse(parts, usage)
+        # Stream text in a few chunks, the way the real API splits a long reply
+        chunks = []
+        for part in parts:
+            if part.function_call:
+                chunks.append(FakeResponse([part]))
+                continue
+            size = max(1, len(part.text) // 3)
+            chunks.extend(FakeResponse([FakePart(text=part.text[start:start + size])]) for start in range(0, len(part.text), size))
+        if chunks:
+            chunks[-1].usage_metadata = usage
+        return iter(chunks)
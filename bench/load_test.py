@@ -0,0 +1,183 @@
+"""
+Offline load test for the auto-responder.
+
+Runs Main.auto_respond() against an in-process fake Instagram client and a fake
+Gemini model, so throughput can be measured without touching real accounts.
+Run it from the repository root:
+
+    python -m bench.load_test --threads 20 --rate 5 --duration 30 --workers 4
+
+and compare the reports (or the --json output) between runs.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fakes import FakeInstagram, FakeGenerativeModel
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the auto-responder with fake Instagram and Gemini backends.")
+    parser.add_argument("--threads", type=int, default=20, help="Number of one-to-one DM threads")
+    parser.add_argument("--rate", type=float, default=2.0, help="Incoming messages per second, across all threads")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds during which messages arrive")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Seconds to wait for the remaining messages to be answered")
+    parser.add_argument("--workers", type=int, default=1, help="THREAD_WORKERS for the run")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Minimum seconds between polls")
+    parser.add_argument("--ig-latency", type=float, default=0.05, help="Mean latency of each Instagram call in seconds")
+    parser.add_argument("--ig-failure-rate", type=float, default=0.0, help="Probability that an Instagram call fails")
+    parser.add_argument("--ig-throttle-rate", type=float, default=0.0, help="Probability that an Instagram call is throttled")
+    parser.add_argument("--inline-messages", type=int, default=5, help="Messages included with each thread in the inbox listing")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Mean latency of each Gemini request in seconds")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Probability that a Gemini request fails")
+    parser.add_argument("--function-call-rate", type=float, default=0.1, help="Probability that a reply asks for a function call")
+    parser.add_argument("--send-rate", type=float, default=50.0, help="Outbox sends per second")
+    parser.add_argument("--client-rate", type=float, default=0.0, help="CLIENT_RATE for the run (calls per second per Instagram endpoint); 0, the default, runs without budgets")
+    parser.add_argument("--acknowledge", action="store_true", help="Send the acknowledgment message before each reply")
+    parser.add_argument("--stream", action="store_true", help="Stream Gemini replies")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON to PATH")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Sets the bot's configuration for the run; must be called before Main is imported."""
+    os.environ.update({
+        "API_KEY": "offline",
+        "SESSION_ID": "offline",
+        "OWNER_USERNAME": "owner",
+        "STATE_DB_PATH": "",
+        "SESSION_SETTINGS_PATH": "",
+        "THREAD_WORKERS": str(args.workers),
+        "THREAD_FETCH_AMOUNT": str(args.threads),
+        "SEND_ACKNOWLEDGMENT": "true" if args.acknowledge else "false",
+        "STREAM_REPLIES": "true" if args.stream else "false",
+        "RESPONSE_CACHE_ENABLED": "false",
+        # Budgets would only measure themselves; the fake backend throttles with --ig-throttle-rate
+        "CLIENT_RATE": str(args.client_rate),
+        "CLIENT_BUDGETS": "",
+    })
+
+
+def percentile(values, q):
+    """Returns the q-th percentile (0-100) of a sorted list by the nearest-rank method."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def run(args):
+    configure_environment(args)
+    tracemalloc.start()
+    import Main
+    from outbox import SendQueue
+    from scheduler import PollScheduler
+
+    # Failures are only injected once the bot has logged in
+    client = FakeInstagram(threads=args.threads, arrival_rate=args.rate, latency=args.ig_latency,
+                           inline_messages=args.inline_messages, owner_username="owner", seed=args.seed)
+    model = FakeGenerativeModel(latency=args.llm_latency, failure_rate=args.llm_failure_rate, function_call_rate=args.function_call_rate,
+                                system_instruction=Main.system_instruction, seed=args.seed)
+    Main.cl = Main.guard.wrap(client)
+    Main.chat_sessions.model = model
+    Main.outbox = SendQueue(Main.cl, rate=args.send_rate, burst=max(1, int(args.send_rate)), metrics=Main.metrics, pause=Main.guard.breaker.retry_in)
+    Main.scheduler = PollScheduler(min_interval=args.poll_interval, max_interval=args.poll_interval * 4, jitter=0.0, cold_every=1)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    stop = threading.Event()
+    with output:
+        if not Main.login():
+            raise RuntimeError("Login against the fake client failed")
+        client.failure_rate = args.ig_failure_rate
+        client.throttle_rate = args.ig_throttle_rate
+        started_at = time.perf_counter()
+        runner = threading.Thread(target=Main.auto_respond, args=(stop,), name="auto-respond", daemon=True)
+        runner.start()
+        time.sleep(args.duration)
+        client.stop_arrivals()
+        drain_deadline = time.perf_counter() + args.drain_timeout
+        while client.unanswered() and time.perf_counter() < drain_deadline:
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started_at
+        stop.set()
+        runner.join()
+        Main.outbox.stop()
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = sorted(client.reply_latencies)
+    messages = max(client.arrived, 1)
+    instagram_calls = sum(count for endpoint, count in client.calls.items() if endpoint != "login_by_sessionid")
+    snapshot = Main.metrics.snapshot()
+    gemini_calls = max(model.calls, 1)
+    return {
+        "config": vars(args),
+        "messages_arrived": client.arrived,
+        "messages_answered": client.answered,
+        "messages_unanswered": client.unanswered(),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_msgs_per_sec": round(client.answered / elapsed, 3),
+        "reply_latency_seconds": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p90": round(percentile(latencies, 90), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+        "instagram_calls_per_message": round(instagram_calls / messages, 3),
+        "instagram_calls": dict(client.calls),
+        "gemini_calls_per_message": round(model.calls / messages, 3),
+        "gemini_prompt_chars_per_call": round(model.prompt_chars / gemini_calls),
+        "gemini_tokens_per_call": {
+            "prompt": round(snapshot["counters"].get("llm_prompt_tokens_total", 0) / gemini_calls),
+            "output": round(snapshot["counters"].get("llm_output_tokens_total", 0) / gemini_calls),
+        },
+        "owner_notifications": client.owner_notifications,
+        "injected_failures": {"instagram": client.injected_failures, "gemini": model.injected_failures},
+        "client_guard": Main.guard.stats(),
+        "peak_memory_mb": {
+            "python_heap": round(peak_traced / 2 ** 20, 2),
+            "max_rss": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),  # ru_maxrss is in KiB on Linux
+        },
+        "metrics": snapshot,
+    }
+
+
+def print_report(report):
+    latency = report["reply_latency_seconds"]
+    memory = report["peak_memory_mb"]
+    print(f"Messages: {report['messages_arrived']} arrived, {report['messages_answered']} answered, {report['messages_unanswered']} unanswered in {report['elapsed_seconds']}s")
+    print(f"Throughput: {report['throughput_msgs_per_sec']} msgs/sec")
+    print(f"Reply latency: p50 {latency['p50']}s, p90 {latency['p90']}s, p99 {latency['p99']}s, max {latency['max']}s")
+    print(f"Instagram calls per message: {report['instagram_calls_per_message']} {report['instagram_calls']}")
+    print(f"Gemini calls per message: {report['gemini_calls_per_message']} (avg prompt {report['gemini_prompt_chars_per_call']} chars)")
+    print(f"Gemini tokens per call: {report['gemini_tokens_per_call']['prompt']} prompt, {report['gemini_tokens_per_call']['output']} output")
+    print(f"Injected failures: {report['injected_failures']}")
+    print(f"Client guard: {report['client_guard']}")
+    print(f"Peak memory: {memory['python_heap']} MB Python heap, {memory['max_rss']} MB max RSS")
+    stages = {name: stats for name, stats in report["metrics"]["histograms"].items() if name.startswith("stage_seconds")}
+    for name, stats in sorted(stages.items()):
+        print(f"  {name}: {stats['count']} calls, avg {stats['avg']}s, p95 <= {stats['p95']}s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Replays a traffic recording made with RECORD_TRAFFIC_PATH against the bot.
+
+The recorded Instagram and Gemini responses are fed back to Main.auto_respond()
+in their original order, either at the recorded pacing (--speed 1, or faster
+with e.g. --speed 4) or as fast as possible (--speed 0). The bot runs with the
+settings in .env, which should match the ones the recording was made with.
+Run it from the repository root:
+
+    python -m bench.replay traffic.jsonl --speed 0 --workers 4
+"""
+import argparse
+import bisect
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recording import POSITIONAL_KEYS, call_arguments, call_thread, redaction
+
+# Instagram methods whose first positional argument is a thread ID
+THREAD_METHODS = {"direct_messages", "direct_thread"}
+
+
+class ReplayExhausted(Exception):
+    """Raised when the bot makes a call the recording has no (more) responses for."""
+
+
+class ReplayedError(Exception):
+    """Base class for errors re-raised from a recording; subclasses carry the recorded error's class name."""
+
+
+_error_classes = {}
+
+
+def replayed_error(error):
+    # Keep the original class name so throttling errors are still counted as rate-limit hits
+    error_class = _error_classes.get(error["type"])
+    if error_class is None:
+        error_class = _error_classes[error["type"]] = type(error["type"], (ReplayedError,), {})
+    return error_class(error["message"])
+
+
+def match_key(target, method, args, kwargs, thread=None):
+    """Identifies a call by its recorded arguments and thread, leaving out text and URLs, which redaction changes."""
+    names = POSITIONAL_KEYS.get((target, method), [])
+    args = [None if isinstance(arg, str) and changed(names[index] if index < len(names) else None) else arg for index, arg in enumerate(args)]
+    return json.dumps([args, {key: value for key, value in kwargs.items() if not (isinstance(value, str) and changed(key))}, thread], sort_keys=True)
+
+
+def changed(key):
+    # Pseudonyms are left in: the names the bot passes on replay come from the recording, so they already match
+    return redaction(key) in ("mask", "drop")
+
+
+def call_threads(target, method, args, kwargs, thread=None):
+    """Returns the IDs of the threads a call is about, so the calls within a thread can be replayed in order."""
+    if target != "instagram":
+        return [thread] if thread else []
+    threads = kwargs.get("thread_ids") or ([kwargs["thread_id"]] if kwargs.get("thread_id") else [])
+    if not threads and method in THREAD_METHODS and args:
+        threads = [args[0]]
+    return [str(thread_id) for thread_id in threads]
+
+
+class Replayed:
+    """Attribute-style view of recorded data; attributes that were not recorded read as None."""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+    def __getattr__(self, name):
+        return None
+
+
+def deserialize(value, shift=0.0, key=None):
+    """Turns recorded data back into objects, moving timestamps forward by `shift` seconds."""
+    if isinstance(value, list):
+        return [deserialize(item, shift) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__datetime__" in value:
+        return datetime.fromtimestamp(value["__datetime__"] + shift)
+    if key == "args":  # function call arguments stay a plain dict
+        return {item_key: deserialize(item, shift) for item_key, item in value.items()}
+    return Replayed({item_key: deserialize(item, shift, item_key) for item_key, item in value.items()})
+
+
+class Recording:
+    """
+    A loaded recording: its header and its calls, queued per (target, method) in recorded order.
+    It also tracks the start times of the calls not replayed yet, overall and per thread,
+    so a replay can hold back an inbox poll until the work recorded before it has been
+    replayed, and a call within a thread until the thread's earlier calls have been.
+    """
+
+    def __init__(self, path):
+        self.header = None
+        self.calls = defaultdict(list)
+        self.span = 0.0
+        self._pending = []  # sorted start times of calls not replayed yet
+        self._thread_pending = defaultdict(list)  # thread ID -> sorted start times of its calls not replayed yet
+        self._progress = threading.Condition()
+        with open(path) as recording_file:
+            for line in recording_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["type"] == "header":
+                    self.header = entry
+                    continue
+                entry["key"] = match_key(entry["target"], entry["method"], entry["args"], entry["kwargs"], entry.get("thread"))
+                entry["threads"] = call_threads(entry["target"], entry["method"], entry["args"], entry["kwargs"], entry.get("thread"))
+                self.calls[(entry["target"], entry["method"])].append(entry)
+                self.span = max(self.span, entry["t"] + entry["duration"])
+                self._pending.append(entry["t"])
+                for thread_id in entry["threads"]:
+                    self._thread_pending[thread_id].append(entry["t"])
+        self._pending.sort()
+        for pending in self._thread_pending.values():
+            pending.sort()
+        if self.header is None:
+            raise ValueError(f"{path} has no header; was the bot logged in while recording?")
+
+    def replayed(self, entry):
+        with self._progress:
+            for pending in [self._pending] + [self._thread_pending[thread_id] for thread_id in entry["threads"]]:
+                index = bisect.bisect_left(pending, entry["t"])
+                if index < len(pending) and pending[index] == entry["t"]:
+                    del pending[index]
+            self._progress.notify_all()
+
+    def wait_for_earlier(self, t, stall_timeout, thread_id=None):
+        """
+        Blocks until every call recorded before time t has been replayed, or with
+        `thread_id`, every call of that thread. If nothing is replayed for stall_timeout
+        seconds, the replay has diverged from the recording, and the calls it is still
+        waiting for are no longer waited on.
+        """
+        with self._progress:
+            pending = self._pending if thread_id is None else self._thread_pending[thread_id]
+            while pending and pending[0] < t:
+                if not self._progress.wait(stall_timeout):
+                    del pending[:bisect.bisect_left(pending, t)]
+
+
+class ReplayTarget:
+    """Serves recorded responses for one target ("instagram" or "gemini"), pacing them like the recording."""
+
+    def __init__(self, recording, target, speed, stall_timeout=2.0):
+        self.recording = recording
+        self.target = target
+        self.speed = speed
+        self.stall_timeout = stall_timeout
+        self.started_at = time.time()
+        # Recorded timestamps move forward so the recording looks like it is happening now
+        self.shift = self.started_at - recording.header["started_at"]
+        self.replayed = Counter()
+        self.unmatched = Counter()
+        self._lock = threading.Lock()
+
+    def remaining(self, method):
+        with self._lock:
+            return len(self.recording.calls[(self.target, method)])
+
+    def next_entry(self, method, args, kwargs):
+        """
+        Takes the first recorded call of the method with the same arguments, once the
+        calls recorded before it in the same thread have been replayed. A call with no
+        such recorded call left is counted as unmatched and raises ReplayExhausted.
+        """
+        # Names and IDs the bot passes come from the recording, so they are already pseudonymized
+        thread = call_thread() if self.target == "gemini" else None
+        key = match_key(self.target, method, *call_arguments(self.target, method, args, kwargs, redacted=False), thread)
+        with self._lock:
+            entries = self.recording.calls[(self.target, method)]
+            index = next((index for index, entry in enumerate(entries) if entry["key"] == key), None)
+            if index is None:
+                self.unmatched[method] += 1
+                raise ReplayExhausted(f"No recorded {self.target} {method} call with these arguments left")
+            entry = entries.pop(index)
+            self.replayed[method] += 1
+        for thread_id in entry["threads"]:
+            self.recording.wait_for_earlier(entry["t"], self.stall_timeout, thread_id)
+        self.recording.replayed(entry)
+        if self.speed:
+            # Never answer earlier than the call was made in the recording, then take as long as it took
+            wait = self.started_at + entry["t"] / self.speed - time.time()
+            time.sleep(max(0.0, wait) + entry["duration"] / self.speed)
+        if "error" in entry:
+            raise replayed_error(entry["error"])
+        return entry
+
+
+class ReplayClient(ReplayTarget):
+    """Stands in for instagrapi's Client, answering every method from the recording."""
+
+    def __init__(self, recording, speed=1.0, stall_timeout=2.0, finished=None):
+        super().__init__(recording, "instagram", speed, stall_timeout)
+        self.user_id = recording.header["user_id"]
+        self.username = recording.header["username"]
+        self.finished = finished or threading.Event()  # set once the last recorded inbox poll has been replayed
+
+    def direct_threads(self, *args, **kwargs):
+        """Replays the next inbox poll once the work recorded before it is done; the replay ends when none are left."""
+        with self._lock:
+            entries = self.recording.calls[(self.target, "direct_threads")]
+            next_t = entries[0]["t"] if entries else None
+        if next_t is None:
+            self.finished.set()
+            return []
+        self.recording.wait_for_earlier(next_t, self.stall_timeout)
+        return deserialize(self.next_entry("direct_threads", args, kwargs).get("result"), self.shift)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def replayed(*args, **kwargs):
+            return deserialize(self.next_entry(name, args, kwargs).get("result"), self.shift)
+        return replayed
+
+
+class ReplayModel(ReplayTarget):
+    """Stands in for genai.GenerativeModel; its chats answer from the recorded Gemini responses in order."""
+
+    def __init__(self, recording, speed=1.0):
+        super().__init__(recording, "gemini", speed)
+
+    def start_chat(self, history=None):
+        return ReplayChat(self, history)
+
+
+class ReplayChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, prompt, stream=False, **kwargs):
+        entry = self.model.next_entry("send_message", (prompt,), dict(kwargs, stream=True) if stream else kwargs)
+        if "chunks" in entry:
+            chunks = [deserialize(chunk["response"]) for chunk in entry["chunks"]]
+        else:
+            chunks = [deserialize(entry["result"])]
+        parts = [part for chunk in chunks for part in chunk.parts]
+        self.history.append(Replayed({"role": "user", "parts": [Replayed({"text": prompt, "function_call": None})]}))
+        self.history.append(Replayed({"role": "model", "parts": parts}))
+        if stream:
+            return iter(chunks)
+        return Replayed({"parts": parts, "usage_metadata": chunks[-1].usage_metadata if chunks else None})
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded Instagram/Gemini traffic file against the auto-responder.")
+    parser.add_argument("recording", help="JSONL file written with RECORD_TRAFFIC_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pacing relative to the recording; 0 replays as fast as possible")
+    parser.add_argument("--workers", type=int, default=1, help="THREAD_WORKERS for the run")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for the replay to finish")
+    parser.add_argument("--stall-timeout", type=float, default=2.0, help="Seconds an inbox poll waits for earlier recorded calls the bot does not make")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON to PATH")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    recording = Recording(args.recording)
+    os.environ.update({
+        "API_KEY": "offline",
+        "SESSION_ID": "offline",
+        "OWNER_USERNAME": recording.header["owner_username"],
+        "STATE_DB_PATH": "",
+        "SESSION_SETTINGS_PATH": "",
+        "RECORD_TRAFFIC_PATH": "",
+        "THREAD_WORKERS": str(args.workers),
+        # The recorded calls already carry the waits the budgets caused, so they are not applied a second time
+        "CLIENT_RATE": "0",
+        "CLIENT_BUDGETS": "",
+    })
+    import Main
+    from outbox import TokenBucket
+    from scheduler import PollScheduler
+
+    # The client ends the poll loop itself when the recording runs out
+    stop = threading.Event()
+    client = ReplayClient(recording, speed=args.speed, stall_timeout=args.stall_timeout, finished=stop)
+    model = ReplayModel(recording, speed=args.speed)
+    Main.cl = Main.guard.wrap(client)
+    Main.chat_sessions.model = model
+    Main.outbox.client = Main.cl
+    # Like the client budgets, the send rate already shaped the recorded pacing
+    Main.outbox.bucket = TokenBucket(1000, 1000)
+    # The replayed calls carry the recorded pacing, so the loop itself should not sleep
+    Main.scheduler = PollScheduler(min_interval=0, max_interval=0.05, jitter=0.0, cold_every=1)
+    Main.start_time = datetime.fromtimestamp(client.started_at)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        started_at = time.perf_counter()
+        Main.login()
+        runner = threading.Thread(target=Main.auto_respond, args=(stop,), name="auto-respond", daemon=True)
+        runner.start()
+        stop.wait(args.timeout)
+        stop.set()
+        runner.join()
+        Main.outbox.stop()
+        elapsed = time.perf_counter() - started_at
+
+    snapshot = Main.metrics.snapshot()
+    return {
+        "config": vars(args),
+        "recorded_seconds": round(recording.span, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "messages_handled": snapshot["counters"].get("messages_handled_total", 0),
+        "instagram_calls": dict(client.replayed),
+        "gemini_calls": model.replayed["send_message"],
+        "unmatched_calls": dict(client.unmatched + model.unmatched),
+        "unreplayed_calls": {f"{target}.{method}": len(entries) for (target, method), entries in recording.calls.items() if entries},
+        "metrics": snapshot,
+    }
+
+
+def print_report(report):
+    print(f"Replayed {report['recorded_seconds']}s of recorded traffic in {report['elapsed_seconds']}s")
+    print(f"Messages handled: {report['messages_handled']}")
+    print(f"Instagram calls: {report['instagram_calls']}")
+    print(f"Gemini calls: {report['gemini_calls']}")
+    if report["unmatched_calls"]:
+        print(f"Calls with no recorded response: {report['unmatched_calls']}")
+    if report["unreplayed_calls"]:
+        print(f"Recorded calls never made: {report['unreplayed_calls']}")
+    for name, stats in sorted(report["metrics"]["histograms"].items()):
+        print(f"  {name}: {stats['count']} calls, avg {stats['avg']}s, p95 <= {stats['p95']}s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+
+from cache import TTLCache
+from outbox import TokenBucket
+
+# instagrapi exception class names by how the bot should react to them
+THROTTLE_ERRORS = {"PleaseWaitFewMinutes", "RateLimitError", "ClientThrottledError", "FeedbackRequired", "SentryBlock"}
+LOGIN_ERRORS = {"LoginRequired", "ChallengeRequired", "ReloginAttemptExceeded", "BadCredentials"}
+
+# Client methods that only read or write local settings; they bypass the budgets and the circuit breaker
+LOCAL_METHODS = {"get_settings", "set_settings", "load_settings", "dump_settings"}
+
+# Read-only endpoints whose last good result may be served while the circuit is open
+CACHEABLE_ENDPOINTS = {"user_info_v1", "user_info_by_username_v1", "user_id_from_username", "direct_messages"}
+
+
+def classify_error(error):
+    """Returns "throttled", "login" or "other" for an exception raised by the Instagram client."""
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & THROTTLE_ERRORS or "429" in str(error):
+        return "throttled"
+    if names & LOGIN_ERRORS:
+        return "login"
+    return "other"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Instagram while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive throttling or login errors and stays open for
+    `base_delay` seconds, doubling (with jitter) each time it re-opens, up to `max_delay`.
+    Once the delay has passed a single probe call is let through: success closes the
+    circuit, failure opens it again for longer.
+    """
+
+    def __init__(self, threshold=2, base_delay=30, max_delay=900, jitter=0.2):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.failures = 0
+        self.opens = 0
+        self.last_error = None
+        self._delay = base_delay
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def retry_in(self):
+        """Seconds until the next probe call is allowed."""
+        return max(0.0, self._open_until - time.monotonic())
+
+    def allow(self):
+        """Returns True if a call may go through now; only one probe is allowed after the circuit has been open."""
+        with self._lock:
+            if time.monotonic() < self._open_until:
+                return False
+            if self.opens and self.failures >= self.threshold:
+                # Half-open: let one call probe whether Instagram has recovered
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.failures >= self.threshold:
+                print("Instagram calls are succeeding again, closing the circuit breaker")
+            self.failures = 0
+            self._delay = self.base_delay
+            self._probing = False
+
+    def record_other(self):
+        """Ends a probe that failed for a reason unrelated to throttling, so another call may probe."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self, error):
+        """Counts a throttling or login error; returns True if this opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._probing = False
+            if self.failures < self.threshold:
+                return False
+            delay = min(self.max_delay, self._delay) * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._open_until = time.monotonic() + delay
+            self._delay = min(self.max_delay, self._delay * 2)
+            self.opens += 1
+        print(f"Instagram is refusing requests ({type(error).__name__}: {error}), pausing calls for {delay:.0f}s")
+        return True
+
+    def stats(self):
+        return {"open": self.is_open(), "retry_in": round(self.retry_in(), 1), "consecutive_failures": self.failures, "opens": self.opens}
+
+
+class ClientGuard:
+    """
+    Shared protection for every Instagram client call: a token-bucket budget per
+    endpoint, a circuit breaker that stops all calls while Instagram is throttling
+    us, and a cache of the last good result of read-only endpoints, which is served
+    while the circuit is open. Wrap a client with wrap().
+    """
+
+    def __init__(self, rate=1.0, burst=10, budgets=None, breaker=None, stale_ttl=3600, metrics=None):
+        self.rate = rate
+        self.burst = burst
+        self.budgets = dict(budgets or {})  # endpoint -> (rate, burst); a rate of 0 means no budget
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics
+        self.login_required = False
+        self.served_stale = 0
+        self.budget_wait = 0.0
+        self._buckets = {}
+        self._stale = TTLCache(maxsize=2000, ttl=stale_ttl)
+        self._lock = threading.Lock()
+
+    def wrap(self, client):
+        return GuardedClient(client, self)
+
+    def _bucket(self, endpoint):
+        with self._lock:
+            if endpoint not in self._buckets:
+                rate, burst = self.budgets.get(endpoint, (self.rate, self.burst))
+                self._buckets[endpoint] = TokenBucket(rate, burst) if rate else None
+            return self._buckets[endpoint]
+
+    def _stale_key(self, endpoint, args, kwargs):
+        if endpoint not in CACHEABLE_ENDPOINTS:
+            return None
+        key = (endpoint, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def call(self, endpoint, function, args, kwargs):
+        key = self._stale_key(endpoint, args, kwargs)
+        bucket = self._bucket(endpoint) if not self.breaker.is_open() else None
+        if bucket is not None:
+            waited = bucket.acquire()
+            self.budget_wait += waited
+            if waited and self.metrics:
+                self.metrics.observe("budget_wait_seconds", waited, endpoint=endpoint)
+        # Checked after waiting for the budget, since the circuit may have opened in the meantime
+        if not self.breaker.allow():
+            stale = self._stale.get(key) if key else None
+            if stale is not None:
+                self.served_stale += 1
+                return stale
+            raise CircuitOpenError(f"Not calling {endpoint}: Instagram calls are paused for another {self.breaker.retry_in():.0f}s")
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == "other":
+                self.breaker.record_other()
+            else:
+                if kind == "login":
+                    self.login_required = True
+                if self.breaker.record_failure(e) and self.metrics:
+                    self.metrics.inc("circuit_opens_total")
+            raise
+        self.breaker.record_success()
+        if key is not None:
+            self._stale.set(key, result)
+        return result
+
+    def stats(self):
+        return dict(self.breaker.stats(), login_required=self.login_required, served_stale=self.served_stale, budget_wait=round(self.budget_wait, 1))
+
+
+class GuardedClient:
+    """Wraps an instagrapi Client so every method call goes through a ClientGuard; attributes pass straight through."""
+
+    def __init__(self, client, guard):
+        self._client = client
+        self._guard = guard
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or not callable(attribute) or name in LOCAL_METHODS:
+            return attribute
+
+        def guarded(*args, **kwargs):
+            return self._guard.call(name, attribute, args, kwargs)
+        return guarded
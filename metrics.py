@@ -0,0 +1,206 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from guard import CircuitOpenError, classify_error
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Buckets for token counts rather than seconds
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Exception class names from the Google API client that mean Gemini is throttling us; Instagram's are classified by the client guard
+GEMINI_RATE_LIMIT_ERRORS = {"ResourceExhausted", "TooManyRequests"}
+
+
+def is_rate_limit_error(error):
+    return classify_error(error) == "throttled" or type(error).__name__ in GEMINI_RATE_LIMIT_ERRORS
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed bucket bounds, in the Prometheus style."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Returns (upper bound, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return float("inf")
+
+
+def _label_text(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency histograms for the auto-respond pipeline.
+    Metrics are identified by a name plus optional labels, and can be exported as
+    Prometheus text (see serve()) or as a JSON snapshot (see start_snapshots()).
+    """
+
+    def __init__(self, prefix="aetherion"):
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, stage, **labels):
+        """
+        Records the duration of a block as stage_seconds{stage=...}, counting errors and
+        rate-limit hits. Calls the circuit breaker turned away are counted separately.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        except CircuitOpenError:
+            self.inc("circuit_rejections_total", stage=stage, **labels)
+            raise
+        except Exception as e:
+            self.inc("errors_total", stage=stage, **labels)
+            if is_rate_limit_error(e):
+                self.inc("rate_limit_hits_total", stage=stage, **labels)
+            raise
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started_at, stage=stage, **labels)
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            seen = set()
+            for kind, items in (("counter", counters), ("gauge", gauges)):
+                for (name, labels), value in items:
+                    metric = f"{self.prefix}_{name}"
+                    if metric not in seen:
+                        seen.add(metric)
+                        lines.append(f"# TYPE {metric} {kind}")
+                    lines.append(f"{metric}{{{_label_text(labels)}}} {value}" if labels else f"{metric} {value}")
+            for (name, labels), histogram in histograms:
+                metric = f"{self.prefix}_{name}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                label_text = _label_text(labels)
+                separator = "," if label_text else ""
+                for bound, total in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'{metric}_bucket{{{label_text}{separator}le="{le}"}} {total}')
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+                lines.append(f"{metric}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Returns all metrics as a JSON-serializable dict, with p50/p95/p99 estimates for histograms."""
+        def name_of(name, labels):
+            return f"{name}{{{_label_text(labels)}}}" if labels else name
+
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "counters": {name_of(name, labels): value for (name, labels), value in self._counters.items()},
+                "gauges": {name_of(name, labels): value for (name, labels), value in self._gauges.items()},
+                "histograms": {
+                    name_of(name, labels): {
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 4),
+                        "avg": round(histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "p99": histogram.quantile(0.99),
+                    }
+                    for (name, labels), histogram in self._histograms.items()
+                },
+            }
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serves the Prometheus text format on http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+    def start_snapshots(self, path, interval=60):
+        """Writes a JSON snapshot to path every `interval` seconds from a background thread."""
+        def write_snapshots():
+            while True:
+                time.sleep(interval)
+                try:
+                    with open(path, "w") as snapshot_file:
+                        json.dump(self.snapshot(), snapshot_file, indent=2)
+                except Exception as e:
+                    print(f"Failed to write metrics snapshot: {e}")
+
+        thread = threading.Thread(target=write_snapshots, name="metrics-snapshots", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,214 @@
+import itertools
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: sustains `rate` tokens per second with bursts of up to `capacity`. A rate of 0 means no limit."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes tokens if they are available right now; returns False otherwise."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Blocks until tokens are available, then takes them. Returns the time spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class OutboundMessage:
+    __slots__ = ("text", "user_ids", "thread_ids", "future")
+
+    def __init__(self, text, user_ids, thread_ids):
+        self.text = text
+        self.user_ids = user_ids
+        self.thread_ids = thread_ids
+        self.future = Future()
+
+
+class SendQueue:
+    """
+    Outbound pipeline for direct messages. send() queues a message and returns a
+    Future right away; a background worker drains the queue at the rate allowed by
+    a token bucket, retrying failed sends with exponential backoff and jitter.
+    Consecutive queued messages with the same text addressed to different threads
+    are combined into a single direct_send call. Urgent messages are sent before
+    regular messages still waiting for other threads or users, but never before an
+    earlier message to the same thread or user, so each conversation keeps its order.
+    If a Metrics instance is given, every direct_send call is timed as the "direct_send" stage.
+    If `pause` is given, it is called before each send and returns the number of
+    seconds to hold off first (e.g. while the client's circuit breaker is open).
+    """
+
+    def __init__(self, client, rate=1.0, burst=5, max_retries=3, backoff=2.0, max_batch=20, metrics=None, pause=None):
+        self.client = client
+        self.metrics = metrics
+        self.pause = pause
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_batch = max_batch
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.api_calls = 0
+        self._queue = queue.PriorityQueue()  # (priority, sequence, message); None as the message stops the worker
+        self._sequence = itertools.count()
+        self._waiting_regular = {}  # destination -> number of regular-priority messages to it still in the queue
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def send(self, text, user_ids=None, thread_ids=None, urgent=False):
+        """Queues a message for users or threads and returns a Future resolving to the sent DirectMessage."""
+        if not user_ids and not thread_ids:
+            raise ValueError("Specify user_ids or thread_ids")
+        message = OutboundMessage(text, [str(uid) for uid in user_ids or []], [str(tid) for tid in thread_ids or []])
+        self._ensure_worker()
+        with self._lock:
+            destinations = self._destinations(message)
+            # An urgent message may not overtake an earlier message to the same conversation
+            if urgent and not any(self._waiting_regular.get(destination) for destination in destinations):
+                priority = 0
+            else:
+                priority = 1
+                for destination in destinations:
+                    self._waiting_regular[destination] = self._waiting_regular.get(destination, 0) + 1
+            self._queue.put((priority, next(self._sequence), message))
+        return message.future
+
+    @staticmethod
+    def _destinations(message):
+        return [("thread", tid) for tid in message.thread_ids] + [("user", uid) for uid in message.user_ids]
+
+    def _take(self, entry):
+        """Returns the message of an entry taken off the queue, updating the count of regular messages waiting."""
+        priority, _, message = entry
+        if message is not None and priority == 1:
+            with self._lock:
+                for destination in self._destinations(message):
+                    self._waiting_regular[destination] -= 1
+                    if not self._waiting_regular[destination]:
+                        del self._waiting_regular[destination]
+        return message
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="send-queue", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            message = self._take(self._queue.get())
+            if message is None:
+                return
+            batch = [message]
+            try:
+                # Pick up whatever else is already waiting so it can be combined
+                while len(batch) < self.max_batch:
+                    try:
+                        entry = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry[2] is None:
+                        self._queue.put(entry)
+                        break
+                    batch.append(self._take(entry))
+                for group in self._combine(batch):
+                    self._deliver(group)
+            except Exception as e:
+                # Whatever went wrong, nobody is left waiting on a message that was taken off the queue
+                print(f"Send queue failed while sending a batch: {e}")
+                for message in batch:
+                    if not message.future.done():
+                        self.failed += 1
+                        message.future.set_exception(e)
+
+    def _combine(self, batch):
+        """Splits a batch into groups that can be sent with one call, keeping the original order."""
+        groups = []
+        for message in batch:
+            previous = groups[-1] if groups else None
+            if (previous and message.thread_ids and previous[0].thread_ids and previous[0].text == message.text
+                    and not set(message.thread_ids) & {tid for m in previous for tid in m.thread_ids}):
+                previous.append(message)
+            else:
+                groups.append([message])
+        return groups
+
+    def _deliver(self, group):
+        text = group[0].text
+        user_ids = group[0].user_ids
+        thread_ids = [tid for message in group for tid in message.thread_ids]
+        for attempt in range(self.max_retries + 1):
+            if self.pause is not None:
+                time.sleep(self.pause())
+            self.bucket.acquire()
+            try:
+                self.api_calls += 1
+                with self.metrics.timed("direct_send") if self.metrics else nullcontext():
+                    if thread_ids:
+                        result = self.client.direct_send(text, thread_ids=thread_ids)
+                    else:
+                        result = self.client.direct_send(text, user_ids)
+                self.sent += len(group)
+                for message in group:
+                    message.future.set_result(result)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(group)
+                    print(f"Failed to send message to {thread_ids or user_ids} after {attempt + 1} attempts: {e}")
+                    for message in group:
+                        message.future.set_exception(e)
+                    return
+                self.retries += 1
+                delay = self.backoff ** attempt * random.uniform(0.5, 1.5)
+                print(f"Send to {thread_ids or user_ids} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=10):
+        """Stops the worker after the messages already queued have been sent."""
+        if self._worker is not None and self._worker.is_alive():
+            # Queued last, so everything already waiting is sent first
+            self._queue.put((2, next(self._sequence), None))
+            self._worker.join(timeout)
+
+    def stats(self):
+        """Returns counters for messages sent, failed and retried, and direct_send calls made."""
+        return {"queued": self.pending(), "sent": self.sent, "failed": self.failed, "retries": self.retries, "api_calls": self.api_calls}
@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from store import MessageRecord, ThreadWatermark
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    users TEXT NOT NULL,
+    auto_responding INTEGER NOT NULL,
+    watermark_floor REAL NOT NULL,
+    watermark_timestamp REAL NOT NULL,
+    watermark_item_id TEXT,
+    recent_ids TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    user_id TEXT,
+    username TEXT,
+    text TEXT,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (thread_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_time ON messages (thread_id, timestamp);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateStore:
+    """
+    SQLite-backed store for the bot's per-thread state (users, auto-response flag,
+    watermark) and recent message history, so a restart resumes from the saved
+    cursors. Writes are buffered in memory and committed in one transaction by
+    flush(); the database runs in WAL mode so commits stay cheap.
+    """
+
+    def __init__(self, path, history_limit=200):
+        self.path = path
+        self.history_limit = history_limit
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._pending_threads = {}  # thread_id -> row, last write wins
+        self._pending_messages = []
+        self._pending_meta = {}
+        self._lock = threading.Lock()
+
+    def save_thread(self, thread_id, users, auto_responding, watermark):
+        """Queues a snapshot of a thread's state for the next flush."""
+        row = (
+            thread_id,
+            json.dumps(users),
+            int(auto_responding),
+            watermark.floor.timestamp(),
+            watermark.timestamp.timestamp(),
+            watermark.item_id,
+            json.dumps([(timestamp.timestamp(), message_id) for timestamp, message_id in watermark.recent()]),
+        )
+        with self._lock:
+            self._pending_threads[thread_id] = row
+
+    def save_message(self, thread_id, record):
+        """Queues a stored message for the next flush."""
+        row = (thread_id, record.id, str(record.user_id), record.username, record.text, record.timestamp.timestamp())
+        with self._lock:
+            self._pending_messages.append(row)
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._pending_meta[key] = str(value)
+
+    def get_meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def flush(self):
+        """Writes all queued changes in a single transaction and returns the number of rows written."""
+        with self._lock:
+            threads = list(self._pending_threads.values())
+            messages = self._pending_messages
+            meta = list(self._pending_meta.items())
+            self._pending_threads = {}
+            self._pending_messages = []
+            self._pending_meta = {}
+        if not (threads or messages or meta):
+            return 0
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?, ?, ?, ?)", threads)
+            self._conn.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?)", messages)
+            self._conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+            if self.history_limit:
+                # Keep the on-disk history as bounded as the in-memory ring buffers
+                for thread_id in {row[0] for row in messages}:
+                    self._conn.execute(
+                        "DELETE FROM messages WHERE thread_id = ? AND message_id NOT IN "
+                        "(SELECT message_id FROM messages WHERE thread_id = ? ORDER BY timestamp DESC LIMIT ?)",
+                        (thread_id, thread_id, self.history_limit),
+                    )
+        return len(threads) + len(messages) + len(meta)
+
+    def load_threads(self, window=100):
+        """Yields (thread_id, users, auto_responding, watermark) for every saved thread."""
+        rows = self._conn.execute("SELECT * FROM threads").fetchall()
+        for thread_id, users, auto_responding, floor, timestamp, item_id, recent_ids in rows:
+            recent = [(datetime.fromtimestamp(recent_timestamp), message_id) for recent_timestamp, message_id in json.loads(recent_ids)]
+            watermark = ThreadWatermark.restore(datetime.fromtimestamp(floor), datetime.fromtimestamp(timestamp), item_id, recent, window=window)
+            yield thread_id, json.loads(users), bool(auto_responding), watermark
+
+    def load_messages(self, thread_id, limit=None):
+        """Returns the most recent saved messages of a thread as MessageRecords, oldest first."""
+        rows = self._conn.execute(
+            "SELECT message_id, user_id, username, text, timestamp FROM messages WHERE thread_id = ? ORDER BY timestamp DESC LIMIT ?",
+            (thread_id, limit or self.history_limit or -1),
+        ).fetchall()
+        return [MessageRecord(message_id, user_id, username, text, datetime.fromtimestamp(timestamp)) for message_id, user_id, username, text, timestamp in reversed(rows)]
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+def load_session(path):
+    """Returns the login session saved by save_session(), or None if there is none or it cannot be read."""
+    try:
+        with open(path) as session_file:
+            return json.load(session_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable session file {path}: {e}")
+        return None
+
+
+def save_session(path, session):
+    """Writes a login session atomically; the file holds session cookies, so only its owner can read it."""
+    temporary_path = path + ".tmp"
+    with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as session_file:
+        json.dump(session, session_file)
+    os.replace(temporary_path, path)
@@ -0,0 +1,275 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+# Strings under these keys are kept verbatim: IDs, types and dates. Numbers, booleans and timestamps are always kept;
+# every other string is masked, pseudonymized or dropped (see `redaction`)
+VERBATIM_KEYS = {"id", "pk", "item_type", "thread_type", "media_type", "product_type", "finish_reason", "since", "until"}
+# Token counts kept from Gemini's usage_metadata
+USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "cached_content_token_count", "total_token_count")
+# Arguments that are never written to a recording, redaction or not
+SECRET_METHODS = {"login_by_sessionid", "login", "set_settings", "load_settings"}
+# Local client methods that hand out or take session secrets; they are passed through without being recorded
+UNRECORDED_METHODS = {"get_settings", "set_settings", "load_settings", "dump_settings"}
+# Names of the positional arguments, per (target, method); unnamed positional strings are masked
+POSITIONAL_KEYS = {
+    ("gemini", "send_message"): ["prompt"],
+    ("instagram", "direct_send"): ["text", "user_ids", "thread_ids"],
+    ("instagram", "direct_threads"): ["amount"],
+    ("instagram", "direct_messages"): ["thread_id", "amount"],
+    ("instagram", "direct_thread"): ["thread_id", "amount"],
+    ("instagram", "user_info_v1"): ["user_id"],
+    ("instagram", "user_info_by_username_v1"): ["username"],
+    ("instagram", "user_id_from_username"): ["username"],
+}
+# Names for results that are a bare string, per (target, method)
+RESULT_KEYS = {("instagram", "user_id_from_username"): "user_id"}
+
+_call_context = threading.local()
+
+
+def set_call_thread(thread_id):
+    """Notes the DM thread the calls made from the current worker are about, so Gemini calls can be matched to it on replay."""
+    _call_context.thread_id = None if thread_id is None else str(thread_id)
+
+
+def call_thread():
+    return getattr(_call_context, "thread_id", None)
+
+
+def pseudonym(value):
+    return "u_" + hashlib.sha256(str(value).encode()).hexdigest()[:10]
+
+
+def mask(text):
+    # Characters come from a hash of the text, so different texts stay different (and are not combined on replay)
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    characters = iter(range(len(text)))
+    return re.sub(r"\w", lambda match: digest[next(characters) % len(digest)], text)
+
+
+def serialize(value):
+    """Converts a call's arguments or result (instagrapi models, Gemini responses, plain data) to JSON-friendly data."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return {"__datetime__": value.timestamp()}
+    if isinstance(value, dict):
+        return {str(key): serialize(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple, set)):
+        return [serialize(item) for item in value]
+    if hasattr(value, "model_dump"):  # instagrapi's pydantic models
+        return serialize(value.model_dump())
+    if hasattr(value, "parts") and not isinstance(value, type):  # Gemini responses and chunks
+        data = {"parts": [serialize_part(part) for part in value.parts]}
+        usage = getattr(value, "usage_metadata", None)
+        if usage is not None:
+            data["usage_metadata"] = {field: getattr(usage, field, 0) or 0 for field in USAGE_FIELDS}
+        return data
+    if hasattr(value, "__slots__"):
+        return {slot: serialize(getattr(value, slot, None)) for slot in value.__slots__ if getattr(value, slot, None) is not None}
+    if hasattr(value, "__dict__"):
+        return serialize({key: item for key, item in vars(value).items() if not key.startswith("_")})
+    return str(value)
+
+
+def serialize_part(part):
+    function_call = getattr(part, "function_call", None)
+    return {
+        "text": getattr(part, "text", "") or "",
+        "function_call": {"name": function_call.name, "args": serialize(dict(function_call.args or {}))} if function_call else None,
+    }
+
+
+def redaction(key):
+    """Returns how a string under `key` is recorded: "keep", "pseudonym", "drop" or "mask"."""
+    key = (key or "").lower()
+    if "email" in key or "phone" in key:
+        return "mask"
+    if key in VERBATIM_KEYS or key.endswith(("_id", "_ids", "_pk", "_type")):
+        return "keep"
+    if "url" in key:
+        return "drop"
+    if "username" in key or key.endswith("_name"):
+        return "pseudonym"
+    return "mask"
+
+
+def redact(value, key=None):
+    """Keeps IDs, numbers and timestamps, pseudonymizes usernames and names, drops URLs and masks every other string."""
+    if isinstance(value, dict):
+        # The name of the tool Gemini calls is kept so replayed calls reach the same tool
+        return {item_key: item if key == "function_call" and item_key == "name" else redact(item, item_key) for item_key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item, key) for item in value]
+    if isinstance(value, str):
+        action = redaction(key)
+        if action == "pseudonym":
+            return pseudonym(value)
+        if action == "drop":
+            return ""
+        if action == "mask":
+            return mask(value)
+    return value
+
+
+def call_arguments(target, method, args, kwargs, redacted=True):
+    """Returns a call's positional and keyword arguments the way they are written to a recording."""
+    if method in SECRET_METHODS:
+        return ["<secret>"] * len(args), {key: "<secret>" for key in kwargs}
+    args, kwargs = serialize(list(args)), serialize(kwargs)
+    if redacted:
+        names = POSITIONAL_KEYS.get((target, method), [])
+        args = [redact(arg, names[index] if index < len(names) else None) for index, arg in enumerate(args)]
+        kwargs = redact(kwargs)
+    return args, kwargs
+
+
+class TrafficRecorder:
+    """
+    Records every call made through wrapped Instagram clients and Gemini models to
+    a JSONL file: the method, its arguments, the result (or error) and its timing.
+    With `redact`, only IDs, numbers and timestamps are kept: text is masked
+    (keeping its shape), usernames and names are replaced by stable pseudonyms
+    and URLs are dropped. Session secrets are never written.
+    A recording can be fed back with bench/replay.py.
+    """
+
+    def __init__(self, path, redact=True):
+        self.path = path
+        self.redact = redact
+        self.started_at = time.time()
+        self.calls = 0
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self.calls += 1
+
+    def write_header(self, user_id, username, owner_username):
+        """Writes the bot's identity, which a replay needs before any call is made."""
+        header = {"type": "header", "started_at": self.started_at, "redacted": self.redact, "user_id": str(user_id), "username": username, "owner_username": owner_username}
+        if self.redact:
+            header["username"] = pseudonym(header["username"])
+            header["owner_username"] = pseudonym(owner_username)
+        self._write(header)
+
+    def record(self, target, method, args, kwargs, started_at, duration, result=None, error=None, chunks=None):
+        args, kwargs = call_arguments(target, method, args, kwargs, self.redact)
+        entry = {
+            "type": "call",
+            "target": target,
+            "method": method,
+            "t": round(started_at - self.started_at, 4),
+            "duration": round(duration, 4),
+            "args": args,
+            "kwargs": kwargs,
+        }
+        if target == "gemini" and call_thread() is not None:
+            entry["thread"] = call_thread()
+        if error is not None:
+            entry["error"] = {"type": type(error).__name__, "message": str(error)}
+        elif chunks is not None:
+            entry["chunks"] = [{"at": round(at, 4), "response": serialize(chunk)} for at, chunk in chunks]
+        else:
+            entry["result"] = serialize(result)
+        if self.redact:
+            for key in ("result", "chunks"):
+                if key in entry:
+                    entry[key] = redact(entry[key], RESULT_KEYS.get((target, method)))
+            if "error" in entry:
+                entry["error"]["message"] = mask(entry["error"]["message"])
+        self._write(entry)
+
+    def timed_call(self, target, method, function, args, kwargs):
+        started_at = time.time()
+        clock = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self.record(target, method, args, kwargs, started_at, time.perf_counter() - clock, error=e)
+            raise
+        self.record(target, method, args, kwargs, started_at, time.perf_counter() - clock, result=result)
+        return result
+
+    def wrap_client(self, client):
+        return RecordingClient(client, self)
+
+    def wrap_model(self, model):
+        return RecordingModel(model, self)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingClient:
+    """Wraps an instagrapi Client so every method call is recorded; attributes pass straight through."""
+
+    def __init__(self, client, recorder):
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name.startswith("_") or not callable(attribute) or name in UNRECORDED_METHODS:
+            return attribute
+
+        def recorded(*args, **kwargs):
+            return self._recorder.timed_call("instagram", name, attribute, args, kwargs)
+        return recorded
+
+
+class RecordingModel:
+    """Wraps a Gemini GenerativeModel so the chats it starts record every send_message."""
+
+    def __init__(self, model, recorder):
+        self._model = model
+        self._recorder = recorder
+
+    def start_chat(self, **kwargs):
+        return RecordingChat(self._model.start_chat(**kwargs), self._recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class RecordingChat:
+    def __init__(self, chat, recorder):
+        self._chat = chat
+        self._recorder = recorder
+
+    @property
+    def history(self):
+        return self._chat.history
+
+    @history.setter
+    def history(self, history):
+        self._chat.history = history
+
+    def send_message(self, prompt, stream=False, **kwargs):
+        if not stream:
+            return self._recorder.timed_call("gemini", "send_message", self._chat.send_message, (prompt,), kwargs)
+        return self._record_stream(prompt, kwargs)
+
+    def _record_stream(self, prompt, kwargs):
+        started_at = time.time()
+        clock = time.perf_counter()
+        chunks = []
+        try:
+            for chunk in self._chat.send_message(prompt, stream=True, **kwargs):
+                chunks.append((time.perf_counter() - clock, chunk))
+                yield chunk
+        except Exception as e:
+            self._recorder.record("gemini", "send_message", (prompt,), dict(kwargs, stream=True), started_at, time.perf_counter() - clock, error=e)
+            raise
+        self._recorder.record("gemini", "send_message", (prompt,), dict(kwargs, stream=True), started_at, time.perf_counter() - clock, chunks=chunks)
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
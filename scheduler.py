@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+from collections import deque
+
+
+class PollScheduler:
+    """
+    Decides how long to sleep between polls and which threads to re-check.
+    While any thread has seen activity within `hot_window` seconds the loop polls
+    every `min_interval` seconds; once everything is idle the interval grows by
+    `backoff` each cycle up to `max_interval`. A random jitter of +/- `jitter`
+    (as a fraction of the interval) is applied to every sleep.
+    Cold threads are only re-checked every `cold_every` cycles.
+    """
+
+    def __init__(self, min_interval=1, max_interval=60, backoff=2.0, jitter=0.2, hot_window=120, cold_every=4, history=50):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.hot_window = hot_window
+        self.cold_every = cold_every
+        self.cycle = 0
+        self.idle_cycles = 0
+        self.last_decision = None
+        self.decisions = deque(maxlen=history)  # recent (cycle, sleep_time, reason) tuples
+        self._interval = min_interval
+        self._last_activity = {}  # thread_id -> monotonic time of the last new message
+        self._active_this_cycle = set()
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        """The current poll interval in seconds, before jitter."""
+        return self._interval
+
+    def mark_activity(self, thread_id):
+        """Records that a thread received new messages."""
+        with self._lock:
+            self._last_activity[thread_id] = time.monotonic()
+            self._active_this_cycle.add(thread_id)
+
+    def is_hot(self, thread_id, now=None):
+        last_activity = self._last_activity.get(thread_id)
+        return last_activity is not None and (now or time.monotonic()) - last_activity < self.hot_window
+
+    def should_check(self, thread_id):
+        """Returns True if a thread is due for a re-check this cycle: hot threads always are, cold ones every `cold_every` cycles."""
+        if self.is_hot(thread_id) or self.cold_every <= 1:
+            return True
+        # Spread cold threads across cycles instead of checking them all at once
+        return (self.cycle + hash(thread_id)) % self.cold_every == 0
+
+    def end_cycle(self):
+        """Updates the poll interval from this cycle's activity and returns the jittered time to sleep."""
+        now = time.monotonic()
+        with self._lock:
+            active = len(self._active_this_cycle)
+            self._active_this_cycle.clear()
+            hot = sum(1 for thread_id in self._last_activity if self.is_hot(thread_id, now))
+            # Forget threads that have been cold for a long time so the map stays small
+            for thread_id in [tid for tid, last in self._last_activity.items() if now - last > self.hot_window * 10]:
+                del self._last_activity[thread_id]
+        self.cycle += 1
+        if active or hot:
+            self.idle_cycles = 0
+            self._interval = self.min_interval
+            reason = f"{active} active, {hot} hot thread(s): polling every {self._interval}s"
+        else:
+            self.idle_cycles += 1
+            self._interval = min(self.max_interval, max(self._interval, self.min_interval, 0.1) * self.backoff)
+            reason = f"idle for {self.idle_cycles} cycle(s): backing off to {self._interval:.1f}s"
+        sleep_time = max(0.0, self._interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+        self.last_decision = reason
+        self.decisions.append((self.cycle, round(sleep_time, 2), reason))
+        return sleep_time
+
+    def stats(self):
+        """Returns the scheduler's current interval, idle streak and last decision."""
+        return {"cycle": self.cycle, "interval": round(self._interval, 2), "idle_cycles": self.idle_cycles, "last_decision": self.last_decision}
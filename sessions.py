@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_text_tokens(text):
+    """Roughly estimates the token count of a piece of text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def estimate_tokens(content):
+    """Roughly estimates the token count of a chat content entry."""
+    text = ""
+    for part in content.parts:
+        text += getattr(part, "text", "") or ""
+        function_call = getattr(part, "function_call", None)
+        if function_call:
+            text += function_call.name + str(dict(function_call.args or {}))
+    return estimate_text_tokens(text)
+
+
+class ChatSessionManager:
+    """
+    Keeps one Gemini chat session per thread so conversations never share context.
+    Each session's history is capped to `max_turns` user/model exchanges and,
+    optionally, `max_tokens` estimated tokens, dropping the oldest turns first.
+    Sessions idle for `idle_ttl` seconds are closed, and the least recently used
+    session is evicted once `max_sessions` are open. Without a model, `model_factory`
+    builds one when the first session is started.
+    """
+
+    def __init__(self, model, max_sessions=100, max_turns=6, max_tokens=0, idle_ttl=3600, model_factory=None):
+        self.model = model
+        self.model_factory = model_factory
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self._sessions = OrderedDict()  # thread_id -> (last_used, chat)
+        self._lock = threading.RLock()
+
+    def load_model(self):
+        """Returns the model, building it with the model factory if it has not been built yet."""
+        with self._lock:
+            if self.model is None:
+                self.model = self.model_factory()
+            return self.model
+
+    def get(self, thread_id):
+        """Returns the chat session for a thread, creating it if needed and trimming its history."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sessions.pop(thread_id, None)
+            chat = entry[1] if entry else self.load_model().start_chat(history=[])
+            self._sessions[thread_id] = (now, chat)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        self.trim(chat)
+        return chat
+
+    def trim(self, chat):
+        """Drops the oldest turns of a chat until it fits the turn and token limits."""
+        history = list(chat.history)
+        original_length = len(history)
+        if self.max_turns and len(history) > self.max_turns * 2:
+            history = history[-self.max_turns * 2:]
+        if self.max_tokens:
+            sizes = [estimate_tokens(content) for content in history]
+            total = sum(sizes)
+            start = 0
+            while total > self.max_tokens and start < len(history):
+                total -= sizes[start]
+                start += 1
+            history = history[start:]
+        # A chat history must start with a user turn
+        while history and history[0].role != "user":
+            history = history[1:]
+        if len(history) != original_length:
+            chat.history = history
+
+    def compact_turn(self, chat, prompt, text):
+        """
+        Replaces `prompt` in the chat's last user turn with `text`. A rendered prompt
+        carries its own copy of the conversation history, so keeping it would send that
+        history again with every later request in the session.
+        """
+        history = chat.history
+        for content in reversed(history):
+            if content.role == "user":
+                if content.parts and content.parts[0].text == prompt:
+                    content.parts[0].text = text
+                return
+
+    def discard(self, thread_id):
+        """Closes the chat session for a thread."""
+        with self._lock:
+            self._sessions.pop(thread_id, None)
+
+    def _evict_idle(self, now):
+        while self._sessions:
+            thread_id, (last_used, _) = next(iter(self._sessions.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._sessions[thread_id]
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        """Returns the number of open sessions and evictions so far."""
+        return {"sessions": len(self._sessions), "evictions": self.evictions}
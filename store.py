@@ -0,0 +1,243 @@
+import re
+import threading
+from collections import deque
+
+word_pattern = re.compile(r"\w+")
+
+
+class MessageRecord:
+    """A single stored direct message."""
+    __slots__ = ("id", "user_id", "username", "text", "timestamp")
+
+    def __init__(self, id, user_id, username, text, timestamp):
+        self.id = id
+        self.user_id = user_id
+        self.username = username
+        self.text = text
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"MessageRecord(id={self.id!r}, username={self.username!r}, timestamp={self.timestamp!r})"
+
+
+class ThreadStore:
+    """
+    Message history for one thread, kept as a ring buffer of the most recent
+    `maxlen` records with a message ID index for O(1) membership checks.
+    `history` holds the (user_id, text) of the last `history_limit` messages
+    for building prompts, updated as messages are added. If a HistoryIndex is
+    given, stored and evicted records are added to and removed from it.
+    """
+    __slots__ = ("users", "maxlen", "history", "thread_id", "search_index", "_messages", "_index")
+
+    def __init__(self, users=None, maxlen=200, history_limit=30, thread_id=None, search_index=None):
+        self.users = list(users or [])
+        self.maxlen = maxlen
+        self.history = deque(maxlen=history_limit or None)
+        self.thread_id = thread_id
+        self.search_index = search_index
+        self._messages = deque()
+        self._index = {}  # message id -> MessageRecord
+
+    def add(self, record):
+        """
+        Stores a record, evicting the oldest one if the buffer is full.
+        Returns False if the message is already stored or is older than everything kept.
+        """
+        if record.id in self._index:
+            return False
+        if self.maxlen and len(self._messages) >= self.maxlen:
+            if record.timestamp < self._messages[0].timestamp:
+                return False
+            evicted = self._messages.popleft()
+            del self._index[evicted.id]
+            if self.search_index is not None:
+                self.search_index.remove(self.thread_id, evicted)
+        self._messages.append(record)
+        self._index[record.id] = record
+        if self.search_index is not None:
+            self.search_index.add(self.thread_id, record)
+        if record.text:
+            self.history.append((str(record.user_id), record.text))
+        return True
+
+    def get(self, message_id, default=None):
+        return self._index.get(message_id, default)
+
+    def __contains__(self, message_id):
+        return message_id in self._index
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+
+class ThreadWatermark:
+    """
+    Tracks which messages of a thread have been processed. Everything at or
+    before `floor` counts as processed; newer messages are checked against a
+    bounded window of recently processed IDs so out-of-order delivery is still
+    deduplicated exactly.
+    """
+    __slots__ = ("timestamp", "item_id", "floor", "window", "_recent", "_recent_ids")
+
+    def __init__(self, floor, window=100):
+        self.timestamp = floor  # timestamp of the newest processed message
+        self.item_id = None  # id of the newest processed message
+        self.floor = floor
+        self.window = window
+        self._recent = deque()  # (timestamp, message id), in processing order
+        self._recent_ids = set()
+
+    def is_processed(self, message):
+        """Returns True if the message has already been handled for this thread."""
+        return message.timestamp <= self.floor or message.id in self._recent_ids
+
+    def mark(self, message):
+        """Records a message as processed, advancing the high-water mark and trimming the ID window."""
+        if self.is_processed(message):
+            return
+        self._recent.append((message.timestamp, message.id))
+        self._recent_ids.add(message.id)
+        if message.timestamp >= self.timestamp:
+            self.timestamp = message.timestamp
+            self.item_id = message.id
+        self._trim()
+
+    def _trim(self):
+        """Evicts the oldest IDs beyond the window, raising the floor so they still count as processed."""
+        while len(self._recent) > self.window:
+            evicted_timestamp, evicted_id = self._recent.popleft()
+            self._recent_ids.discard(evicted_id)
+            self.floor = max(self.floor, evicted_timestamp)
+
+    def recent(self):
+        """Returns the (timestamp, message id) pairs in the recent-ID window, oldest first."""
+        return list(self._recent)
+
+    @classmethod
+    def restore(cls, floor, timestamp, item_id, recent, window=100):
+        """Rebuilds a watermark from previously saved state, possibly with a smaller window."""
+        watermark = cls(floor, window=window)
+        watermark.timestamp = timestamp
+        watermark.item_id = item_id
+        for recent_timestamp, message_id in recent:
+            watermark._recent.append((recent_timestamp, message_id))
+            watermark._recent_ids.add(message_id)
+        watermark._trim()
+        return watermark
+
+
+class UsernameIndex:
+    """
+    Maps usernames to user IDs and to the one-to-one thread with that user.
+    It is filled from data the poll loop already fetches, so owner commands can
+    resolve recipients locally. Usernames are matched case-insensitively.
+    """
+
+    def __init__(self):
+        self._user_ids = {}  # username -> user id
+        self._thread_ids = {}  # username -> thread id of the one-to-one thread with that user
+
+    @staticmethod
+    def normalize(username):
+        return username.strip().lstrip("@").lower()
+
+    def add_user(self, username, user_id):
+        if username and user_id:
+            self._user_ids[self.normalize(username)] = str(user_id)
+
+    def add_thread(self, thread_id, users):
+        """Indexes the users of a thread; one-to-one threads are also indexed by the other user's username."""
+        for user in users:
+            self.add_user(user.username, user.pk)
+        if len(users) == 1 and users[0].username:
+            self._thread_ids[self.normalize(users[0].username)] = thread_id
+
+    def user_id(self, username):
+        return self._user_ids.get(self.normalize(username))
+
+    def thread_id(self, username):
+        return self._thread_ids.get(self.normalize(username))
+
+    def __len__(self):
+        return len(self._user_ids)
+
+
+class HistoryIndex:
+    """
+    Searchable index over the messages held by the ThreadStores: inverted indexes
+    by thread, by user (ID or username) and by word. search() intersects them,
+    filters by time range and returns one page of matches, newest first.
+    """
+
+    def __init__(self):
+        self._records = {}  # (thread id, message id) -> MessageRecord
+        self._by_thread = {}  # thread id -> keys
+        self._by_user = {}  # user id or lowercase username -> keys
+        self._by_word = {}  # lowercase word -> keys
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def words(text):
+        return {word.lower() for word in word_pattern.findall(text or "")}
+
+    def _postings(self, record):
+        yield self._by_user, str(record.user_id)
+        if record.username:
+            yield self._by_user, record.username.lower()
+        for word in self.words(record.text):
+            yield self._by_word, word
+
+    def add(self, thread_id, record):
+        key = (str(thread_id), record.id)
+        with self._lock:
+            self._records[key] = record
+            self._by_thread.setdefault(key[0], set()).add(key)
+            for index, term in self._postings(record):
+                index.setdefault(term, set()).add(key)
+
+    def remove(self, thread_id, record):
+        key = (str(thread_id), record.id)
+        with self._lock:
+            if self._records.pop(key, None) is None:
+                return
+            for index, term in [(self._by_thread, key[0])] + list(self._postings(record)):
+                keys = index.get(term)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[term]
+
+    def search(self, thread_id=None, user=None, query=None, since=None, until=None, offset=0, limit=20):
+        """
+        Returns (total matches, [(thread id, MessageRecord), ...]) for one page of the
+        messages matching every given filter: a thread, a user ID or username, all words
+        of `query`, and timestamps within [since, until].
+        """
+        with self._lock:
+            candidates = []
+            if thread_id is not None:
+                candidates.append(self._by_thread.get(str(thread_id), set()))
+            if user:
+                candidates.append(self._by_user.get(str(user).lstrip("@").lower(), set()))
+            for word in self.words(query):
+                candidates.append(self._by_word.get(word, set()))
+            if candidates:
+                # Intersecting from the smallest set keeps the work proportional to the rarest filter
+                candidates.sort(key=len)
+                keys = set(candidates[0]).intersection(*candidates[1:])
+            else:
+                keys = set(self._records)
+            matches = [(key[0], self._records[key]) for key in keys]
+        if since is not None:
+            matches = [match for match in matches if match[1].timestamp >= since]
+        if until is not None:
+            matches = [match for match in matches if match[1].timestamp <= until]
+        matches.sort(key=lambda match: match[1].timestamp, reverse=True)
+        return len(matches), matches[offset:offset + limit]
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,45 @@
+from string import Formatter
+
+
+class PromptTemplate:
+    """
+    A str.format-style template parsed once into literal text and field names,
+    then rendered in a single pass. Fields known up front can be baked into the
+    literal text with bind(), so each render only fills the fields that change.
+    """
+
+    def __init__(self, template):
+        self.segments = []  # (literal, field_name or None)
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            if format_spec or conversion:
+                raise ValueError(f"Unsupported format spec or conversion on field {{{field_name}}}")
+            if field_name is not None and not field_name.isidentifier():
+                raise ValueError(f"Unsupported field {{{field_name}}}")
+            self.segments.append((literal, field_name))
+        self.fields = {field_name for _, field_name in self.segments if field_name}
+
+    def bind(self, **values):
+        """Returns a copy of the template with the given fields filled in permanently."""
+        bound = PromptTemplate.__new__(PromptTemplate)
+        bound.segments = []
+        pending = ""
+        for literal, field_name in self.segments:
+            pending += literal
+            if field_name in values:
+                pending += str(values[field_name])
+            else:
+                bound.segments.append((pending, field_name))
+                pending = ""
+        if pending:
+            bound.segments.append((pending, None))
+        bound.fields = self.fields - values.keys()
+        return bound
+
+    def render(self, **values):
+        """Fills in every remaining field; raises KeyError if one is missing."""
+        parts = []
+        for literal, field_name in self.segments:
+            parts.append(literal)
+            if field_name:
+                parts.append(str(values[field_name]))
+        return "".join(parts)
@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_get_counts_hits_and_misses(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("b", "default"), "default")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertAlmostEqual(cache.hit_rate, 1 / 3)
+
+    def test_expired_entries_are_missing(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set("short", 1, ttl=0.01)
+        cache.set("long", 2)
+        time.sleep(0.02)
+        self.assertNotIn("short", cache)
+        self.assertIsNone(cache.get("short"))
+        self.assertEqual(cache.get("long"), 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("b", cache)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+    def test_get_or_load_only_loads_on_a_miss(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return "profile"
+        self.assertEqual(cache.get_or_load("user", loader), "profile")
+        self.assertEqual(cache.get_or_load("user", loader), "profile")
+        self.assertEqual(len(loads), 1)
+
+    def test_pop_and_clear(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set("a", 1)
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertEqual(cache.pop("a", "gone"), "gone")
+        cache.set("b", 2)
+        cache.get("b")
+        cache.clear()
+        self.assertEqual(cache.stats(), {"size": 0, "hits": 0, "misses": 0, "hit_rate": 0.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
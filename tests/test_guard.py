@@ -0,0 +1,94 @@
+import contextlib
+import io
+import time
+import unittest
+
+from guard import CircuitBreaker, classify_error
+
+DELAY = 0.05
+
+
+class PleaseWaitFewMinutes(Exception):
+    pass
+
+
+class LoginRequired(Exception):
+    pass
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, base_delay=DELAY, max_delay=DELAY * 4, jitter=0)
+        # The breaker reports opening and closing on stdout
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+
+    def open(self):
+        self.breaker.record_failure(PleaseWaitFewMinutes("wait"))
+        self.assertTrue(self.breaker.record_failure(PleaseWaitFewMinutes("wait")))
+
+    def wait_until_half_open(self):
+        time.sleep(self.breaker.retry_in() + 0.01)
+
+    def test_opens_after_consecutive_failures(self):
+        self.assertFalse(self.breaker.record_failure(PleaseWaitFewMinutes("wait")))
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.record_failure(PleaseWaitFewMinutes("wait")))
+        self.assertTrue(self.breaker.is_open())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.opens, 1)
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure(PleaseWaitFewMinutes("wait"))
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.record_failure(PleaseWaitFewMinutes("wait")))
+        self.assertFalse(self.breaker.is_open())
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.open()
+        self.wait_until_half_open()
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        # A successful probe closes the circuit
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens_for_longer(self):
+        self.open()
+        first_delay = self.breaker.retry_in()
+        self.wait_until_half_open()
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.record_failure(PleaseWaitFewMinutes("still waiting")))
+        self.assertGreater(self.breaker.retry_in(), first_delay)
+        self.assertEqual(self.breaker.opens, 2)
+        self.assertEqual(str(self.breaker.last_error), "still waiting")
+
+    def test_unrelated_probe_failure_lets_another_call_probe(self):
+        self.open()
+        self.wait_until_half_open()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_other()
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.is_open())
+
+    def test_delay_is_capped(self):
+        for _ in range(5):
+            self.breaker.record_failure(PleaseWaitFewMinutes("wait"))
+        self.assertLessEqual(self.breaker.retry_in(), DELAY * 4)
+
+
+class ClassifyErrorTest(unittest.TestCase):
+    def test_classifies_by_class_name_and_status(self):
+        self.assertEqual(classify_error(PleaseWaitFewMinutes("wait")), "throttled")
+        self.assertEqual(classify_error(RuntimeError("HTTP 429 Too Many Requests")), "throttled")
+        self.assertEqual(classify_error(LoginRequired("log in")), "login")
+        self.assertEqual(classify_error(ValueError("bad")), "other")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import threading
+import unittest
+
+from outbox import SendQueue
+
+TIMEOUT = 5
+
+
+class RecordingClient:
+    """Records direct_send calls; the first call blocks until `release` is set, so messages can pile up behind it."""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def direct_send(self, text, user_ids=None, thread_ids=None):
+        self.started.set()
+        self.release.wait(TIMEOUT)
+        self.calls.append((text, tuple(thread_ids or ()), tuple(user_ids or ())))
+        return text
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.client = RecordingClient()
+        self.outbox = SendQueue(self.client, rate=1000, burst=1000)
+
+    def tearDown(self):
+        self.client.release.set()
+        self.outbox.stop()
+
+    def hold(self):
+        """Sends a first message and waits until the worker is busy with it."""
+        self.outbox.send("first", thread_ids=["hold"])
+        self.assertTrue(self.client.started.wait(TIMEOUT))
+
+    def sent_texts(self):
+        self.client.release.set()
+        self.outbox.stop()
+        return [text for text, _, _ in self.client.calls]
+
+    def test_sends_in_order(self):
+        self.hold()
+        for index in range(3):
+            self.outbox.send(f"message {index}", thread_ids=[f"t{index}"])
+        self.assertEqual(self.sent_texts(), ["first", "message 0", "message 1", "message 2"])
+
+    def test_urgent_message_goes_ahead_of_other_threads(self):
+        self.hold()
+        self.outbox.send("regular", thread_ids=["a"])
+        self.outbox.send("urgent", thread_ids=["b"], urgent=True)
+        self.outbox.send("owner", user_ids=["1"], urgent=True)
+        self.assertEqual(self.sent_texts(), ["first", "urgent", "owner", "regular"])
+
+    def test_urgent_message_never_overtakes_its_own_thread(self):
+        self.hold()
+        self.outbox.send("other thread", thread_ids=["b"])
+        self.outbox.send("acknowledgment", thread_ids=["a"])
+        self.outbox.send("reply 1", thread_ids=["a"], urgent=True)
+        self.outbox.send("reply 2", thread_ids=["a"], urgent=True)
+        self.assertEqual(self.sent_texts(), ["first", "other thread", "acknowledgment", "reply 1", "reply 2"])
+
+    def test_urgent_acknowledgment_and_reply_go_ahead_of_regular_threads(self):
+        self.hold()
+        for index in range(3):
+            self.outbox.send(f"regular reply {index}", thread_ids=[f"t{index}"])
+        # The owner's thread sends its acknowledgment and reply with the thread's urgency
+        self.outbox.send("ack", thread_ids=["owner"], urgent=True)
+        self.outbox.send("owner reply", thread_ids=["owner"], urgent=True)
+        self.assertEqual(self.sent_texts(), ["first", "ack", "owner reply", "regular reply 0", "regular reply 1", "regular reply 2"])
+
+    def test_urgent_message_goes_ahead_once_its_thread_is_clear(self):
+        self.hold()
+        self.outbox.send("regular", thread_ids=["b"])
+        self.outbox.send("urgent", thread_ids=["hold"], urgent=True)
+        # The message being sent to "hold" has already left the queue
+        self.assertEqual(self.sent_texts(), ["first", "urgent", "regular"])
+
+    def test_same_text_to_different_threads_is_combined(self):
+        self.hold()
+        futures = [self.outbox.send("hello", thread_ids=[thread_id]) for thread_id in ("a", "b")]
+        self.outbox.send("hello", thread_ids=["a"])
+        self.client.release.set()
+        self.outbox.stop()
+        self.assertEqual(self.client.calls[1:], [("hello", ("a", "b"), ()), ("hello", ("a",), ())])
+        self.assertEqual([future.result(TIMEOUT) for future in futures], ["hello", "hello"])
+        self.assertEqual(self.outbox.stats()["api_calls"], 3)
+
+    def test_zero_rate_sends_without_a_limit(self):
+        outbox = SendQueue(RecordingClient(), rate=0, burst=0)
+        outbox.client.release.set()
+        futures = [outbox.send(f"message {index}", thread_ids=["a"]) for index in range(3)]
+        self.assertEqual([future.result(TIMEOUT) for future in futures], ["message 0", "message 1", "message 2"])
+        outbox.stop()
+
+    def test_unexpected_failure_fails_the_batch_and_keeps_the_worker(self):
+        def pause():
+            raise RuntimeError("pause failed")
+        outbox = SendQueue(RecordingClient(), rate=1000, burst=1000, pause=pause)
+        outbox.client.release.set()
+        with self.assertRaises(RuntimeError):
+            outbox.send("lost", thread_ids=["a"]).result(TIMEOUT)
+        outbox.pause = None
+        self.assertEqual(outbox.send("delivered", thread_ids=["a"]).result(TIMEOUT), "delivered")
+        self.assertEqual(outbox.stats()["failed"], 1)
+        outbox.stop()
+
+    def test_requires_a_destination(self):
+        with self.assertRaises(ValueError):
+            self.outbox.send("nowhere")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from persistence import StateStore
+from store import MessageRecord, ThreadWatermark
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def record(message_id, seconds, text="hello"):
+    return MessageRecord(message_id, "2002", "jane", text, START + timedelta(seconds=seconds))
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state.db")
+        self.store = StateStore(self.path, history_limit=3)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.store.close()
+        self.store = StateStore(self.path, history_limit=3)
+
+    def test_thread_state_round_trips(self):
+        watermark = ThreadWatermark(START, window=3)
+        for index in (1, 3, 2):
+            watermark.mark(SimpleNamespace(id=f"m{index}", timestamp=START + timedelta(seconds=index)))
+        users = [{"pk": "2002", "username": "jane"}]
+        self.store.save_thread("t1", users, False, watermark)
+        self.store.flush()
+        self.reopen()
+        [(thread_id, loaded_users, responding, loaded)] = list(self.store.load_threads(window=3))
+        self.assertEqual((thread_id, loaded_users, responding), ("t1", users, False))
+        self.assertEqual((loaded.floor, loaded.timestamp, loaded.item_id), (watermark.floor, watermark.timestamp, watermark.item_id))
+        self.assertEqual(loaded.recent(), watermark.recent())
+
+    def test_messages_round_trip_oldest_first_and_stay_bounded(self):
+        for index in range(5):
+            self.store.save_message("t1", record(f"m{index}", index, f"message {index}"))
+        self.store.save_message("t2", record("other", 0))
+        self.store.flush()
+        self.reopen()
+        loaded = self.store.load_messages("t1")
+        self.assertEqual([message.id for message in loaded], ["m2", "m3", "m4"])
+        newest = loaded[-1]
+        self.assertEqual((newest.user_id, newest.username, newest.text, newest.timestamp), ("2002", "jane", "message 4", START + timedelta(seconds=4)))
+        self.assertEqual([message.id for message in self.store.load_messages("t2")], ["other"])
+
+    def test_nothing_is_written_before_flush(self):
+        self.store.set_meta("last_poll_at", 1.5)
+        self.store.save_message("t1", record("m1", 1))
+        self.assertIsNone(self.store.get_meta("last_poll_at"))
+        self.assertEqual(self.store.flush(), 2)
+        self.assertEqual(self.store.get_meta("last_poll_at"), "1.5")
+        self.assertEqual(self.store.flush(), 0)
+
+    def test_saving_a_message_twice_keeps_one_copy(self):
+        self.store.save_message("t1", record("m1", 1))
+        self.store.flush()
+        self.store.save_message("t1", record("m1", 1))
+        self.store.flush()
+        self.assertEqual(len(self.store.load_messages("t1")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import unittest
+
+from recording import call_arguments, mask, pseudonym, redact
+
+# A user_info_v1 result and a direct_threads entry, shaped like instagrapi's model_dump() after serialize()
+USER = {
+    "pk": "5811447",
+    "username": "jane.doe",
+    "full_name": "Jane Doe",
+    "is_private": False,
+    "profile_pic_url": "https://instagram.example/jane.jpg",
+    "profile_pic_url_hd": "https://instagram.example/jane_hd.jpg",
+    "is_verified": False,
+    "media_count": 42,
+    "follower_count": 1200,
+    "following_count": 300,
+    "biography": "Baker in Leeds. Call me!",
+    "bio_links": [{"link_id": "17900", "url": "https://jane.example/shop", "title": "Jane's shop"}],
+    "external_url": "https://jane.example",
+    "account_type": 2,
+    "is_business": True,
+    "public_email": "jane@example.com",
+    "contact_phone_number": "+44 7700 900123",
+    "public_phone_country_code": "44",
+    "public_phone_number": "7700900123",
+    "business_contact_method": "CALL",
+    "category_name": "Bakery",
+}
+THREAD = {
+    "pk": "17850000",
+    "id": "340282366841710300949128",
+    "users": [{"pk": "5811447", "username": "jane.doe", "full_name": "Jane Doe", "profile_pic_url": "https://instagram.example/jane.jpg"}],
+    "inviter": {"pk": "5811447", "username": "jane.doe", "full_name": "Jane Doe"},
+    "thread_title": "Jane Doe",
+    "thread_type": "private",
+    "is_group": False,
+    "last_activity_at": {"__datetime__": 1735732800.0},
+    "messages": [
+        {
+            "id": "31000001",
+            "user_id": "5811447",
+            "thread_id": "340282366841710300949128",
+            "timestamp": {"__datetime__": 1735732800.0},
+            "item_type": "media_share",
+            "text": "Can you make my wedding cake? My number is 07700 900123",
+            "media_share": {"pk": "3100", "caption_text": "Our wedding, 12 June", "user": {"pk": "5811447", "username": "jane.doe"}},
+        }
+    ],
+}
+# A streamed Gemini chunk calling a tool with details about the sender
+GEMINI_CHUNK = {
+    "parts": [
+        {
+            "text": "",
+            "function_call": {
+                "name": "notify_owner",
+                "args": {"message": "Jane wants a cake", "sender_username": "jane.doe", "sender_full_name": "Jane Doe", "query": "wedding cake", "thread_id": "340282366841710300949128", "max_count": 5},
+            },
+        }
+    ],
+    "usage_metadata": {"prompt_token_count": 310, "candidates_token_count": 12, "cached_content_token_count": 0, "total_token_count": 322},
+}
+PERSONAL = ["jane", "Jane", "Doe", "Leeds", "7700", "900123", "wedding", "Bakery", "shop"]
+
+
+class RedactTest(unittest.TestCase):
+    def assertNoPersonalData(self, data):
+        text = json.dumps(data)
+        for value in PERSONAL:
+            self.assertNotIn(value, text)
+
+    def test_user_info_keeps_only_ids_and_counts(self):
+        redacted = redact(USER)
+        self.assertNoPersonalData(redacted)
+        self.assertEqual(redacted["pk"], "5811447")
+        self.assertEqual(redacted["follower_count"], 1200)
+        self.assertEqual(redacted["is_business"], True)
+        self.assertEqual(redacted["bio_links"][0]["link_id"], "17900")
+        self.assertEqual(redacted["bio_links"][0]["url"], "")
+        self.assertEqual(redacted["username"], pseudonym("jane.doe"))
+        self.assertEqual(redacted["public_email"], mask("jane@example.com"))
+
+    def test_thread_keeps_ids_types_and_timestamps(self):
+        redacted = redact(THREAD)
+        self.assertNoPersonalData(redacted)
+        message = redacted["messages"][0]
+        self.assertEqual((redacted["id"], message["id"], message["user_id"], message["thread_id"]), (THREAD["id"], "31000001", "5811447", THREAD["id"]))
+        self.assertEqual((redacted["thread_type"], message["item_type"]), ("private", "media_share"))
+        self.assertEqual(message["timestamp"], {"__datetime__": 1735732800.0})
+        # Masking keeps the shape of the text, and pseudonyms line up across the payload
+        self.assertEqual(len(message["text"]), len(THREAD["messages"][0]["text"]))
+        self.assertEqual(redacted["users"][0]["username"], message["media_share"]["user"]["username"])
+
+    def test_tool_call_arguments_are_redacted(self):
+        redacted = redact(GEMINI_CHUNK)
+        self.assertNoPersonalData(redacted)
+        function_call = redacted["parts"][0]["function_call"]
+        self.assertEqual(function_call["name"], "notify_owner")
+        self.assertEqual(function_call["args"]["sender_username"], pseudonym("jane.doe"))
+        self.assertEqual(function_call["args"]["thread_id"], "340282366841710300949128")
+        self.assertEqual(function_call["args"]["max_count"], 5)
+        self.assertEqual(redacted["usage_metadata"], GEMINI_CHUNK["usage_metadata"])
+
+    def test_call_arguments_keep_ids_and_redact_the_rest(self):
+        args, kwargs = call_arguments("instagram", "direct_send", ["Hi Jane, see you in Leeds"], {"thread_ids": ["340282366841710300949128"]})
+        self.assertNoPersonalData([args, kwargs])
+        self.assertEqual(kwargs["thread_ids"], ["340282366841710300949128"])
+        args, _ = call_arguments("instagram", "direct_messages", ["340282366841710300949128", 20], {})
+        self.assertEqual(args, ["340282366841710300949128", 20])
+        # Positional strings whose meaning is not known are masked
+        args, _ = call_arguments("instagram", "search_users", ["jane.doe"], {})
+        self.assertNoPersonalData(args)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from scheduler import PollScheduler
+
+
+class PollSchedulerTest(unittest.TestCase):
+    def test_backs_off_while_idle_up_to_the_maximum(self):
+        scheduler = PollScheduler(min_interval=1, max_interval=5, backoff=2.0, jitter=0)
+        self.assertEqual([scheduler.end_cycle() for _ in range(4)], [2, 4, 5, 5])
+        self.assertEqual(scheduler.idle_cycles, 4)
+
+    def test_activity_resets_to_the_minimum_interval(self):
+        scheduler = PollScheduler(min_interval=1, max_interval=60, jitter=0)
+        for _ in range(3):
+            scheduler.end_cycle()
+        scheduler.mark_activity("t1")
+        self.assertEqual(scheduler.end_cycle(), 1)
+        # The thread stays hot, so the loop keeps polling quickly
+        self.assertEqual(scheduler.end_cycle(), 1)
+        self.assertEqual(scheduler.idle_cycles, 0)
+
+    def test_jitter_stays_within_bounds(self):
+        scheduler = PollScheduler(min_interval=10, max_interval=10, jitter=0.2)
+        for _ in range(20):
+            self.assertTrue(8 <= scheduler.end_cycle() <= 12)
+
+    def test_cold_threads_are_checked_every_few_cycles(self):
+        scheduler = PollScheduler(cold_every=4, jitter=0)
+        scheduler.mark_activity("hot")
+        checks = {"hot": 0, "cold": 0}
+        for _ in range(8):
+            for thread_id in checks:
+                checks[thread_id] += scheduler.should_check(thread_id)
+            scheduler.end_cycle()
+        self.assertEqual(checks, {"hot": 8, "cold": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from store import HistoryIndex, MessageRecord, ThreadStore, ThreadWatermark
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def message(item_id, seconds):
+    return SimpleNamespace(id=item_id, timestamp=START + timedelta(seconds=seconds))
+
+
+class ThreadWatermarkTest(unittest.TestCase):
+    def test_messages_at_or_before_the_floor_are_processed(self):
+        watermark = ThreadWatermark(START)
+        self.assertTrue(watermark.is_processed(message("old", -5)))
+        self.assertTrue(watermark.is_processed(message("same", 0)))
+        self.assertFalse(watermark.is_processed(message("new", 1)))
+
+    def test_mark_advances_the_high_water_mark(self):
+        watermark = ThreadWatermark(START)
+        watermark.mark(message("a", 1))
+        watermark.mark(message("b", 2))
+        self.assertEqual(watermark.timestamp, START + timedelta(seconds=2))
+        self.assertEqual(watermark.item_id, "b")
+        self.assertEqual(watermark.floor, START)
+
+    def test_window_eviction_advances_the_floor(self):
+        watermark = ThreadWatermark(START, window=2)
+        for index in range(1, 4):
+            watermark.mark(message(f"m{index}", index))
+        self.assertEqual(watermark.floor, START + timedelta(seconds=1))
+        self.assertEqual(watermark.recent(), [(START + timedelta(seconds=2), "m2"), (START + timedelta(seconds=3), "m3")])
+        # The evicted ID is still processed through the floor
+        self.assertTrue(watermark.is_processed(message("m1", 1)))
+        self.assertFalse(watermark.is_processed(message("m4", 4)))
+
+    def test_out_of_order_delivery(self):
+        watermark = ThreadWatermark(START)
+        watermark.mark(message("late", 3))
+        # An older message that shows up after a newer one is still answered once
+        self.assertFalse(watermark.is_processed(message("early", 2)))
+        watermark.mark(message("early", 2))
+        self.assertTrue(watermark.is_processed(message("early", 2)))
+        self.assertTrue(watermark.is_processed(message("late", 3)))
+        self.assertFalse(watermark.is_processed(message("earlier", 1)))
+        # The high-water mark stays at the newest message
+        self.assertEqual(watermark.item_id, "late")
+        self.assertEqual(watermark.timestamp, START + timedelta(seconds=3))
+
+    def test_marking_twice_is_a_no_op(self):
+        watermark = ThreadWatermark(START)
+        watermark.mark(message("a", 1))
+        watermark.mark(message("a", 1))
+        self.assertEqual(len(watermark.recent()), 1)
+
+    def test_restore_gives_the_same_answers(self):
+        watermark = ThreadWatermark(START, window=3)
+        for index in (1, 3, 2, 5, 4):
+            watermark.mark(message(f"m{index}", index))
+        restored = ThreadWatermark.restore(watermark.floor, watermark.timestamp, watermark.item_id, watermark.recent(), window=3)
+        self.assertEqual(restored.floor, watermark.floor)
+        self.assertEqual(restored.timestamp, watermark.timestamp)
+        self.assertEqual(restored.item_id, watermark.item_id)
+        self.assertEqual(restored.recent(), watermark.recent())
+        for index in range(0, 8):
+            candidate = message(f"m{index}", index)
+            self.assertEqual(restored.is_processed(candidate), watermark.is_processed(candidate), candidate.id)
+
+    def test_restore_into_a_smaller_window_raises_the_floor(self):
+        watermark = ThreadWatermark(START, window=5)
+        for index in range(1, 5):
+            watermark.mark(message(f"m{index}", index))
+        restored = ThreadWatermark.restore(watermark.floor, watermark.timestamp, watermark.item_id, watermark.recent(), window=2)
+        self.assertEqual(len(restored.recent()), 2)
+        self.assertEqual(restored.floor, START + timedelta(seconds=2))
+        for index in range(1, 5):
+            self.assertTrue(restored.is_processed(message(f"m{index}", index)))
+        self.assertFalse(restored.is_processed(message("m5", 5)))
+
+
+def record(item_id, seconds, text, user_id="2002", username="jane"):
+    return MessageRecord(item_id, user_id, username, text, START + timedelta(seconds=seconds))
+
+
+class HistoryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = HistoryIndex()
+        self.index.add("t1", record("a", 1, "Is the bakery open on Sunday?"))
+        self.index.add("t1", record("b", 2, "Thanks, see you Sunday", user_id="1000", username="bot"))
+        self.index.add("t2", record("c", 3, "Do you deliver cakes on sunday", user_id="3003", username="Sam"))
+        self.index.add("t2", record("d", 4, "What about Monday?", user_id="3003", username="Sam"))
+
+    def ids(self, result):
+        total, page = result
+        return total, [(thread_id, message.id) for thread_id, message in page]
+
+    def test_filters_are_combined(self):
+        self.assertEqual(self.ids(self.index.search(query="sunday")), (3, [("t2", "c"), ("t1", "b"), ("t1", "a")]))
+        self.assertEqual(self.ids(self.index.search(thread_id="t1", query="Sunday")), (2, [("t1", "b"), ("t1", "a")]))
+        self.assertEqual(self.ids(self.index.search(user="@sam", query="sunday")), (1, [("t2", "c")]))
+        self.assertEqual(self.ids(self.index.search(user="3003")), (2, [("t2", "d"), ("t2", "c")]))
+        # Every word of the query has to match
+        self.assertEqual(self.ids(self.index.search(query="sunday cakes")), (1, [("t2", "c")]))
+        self.assertEqual(self.ids(self.index.search(query="sunday pies")), (0, []))
+
+    def test_time_range_and_paging(self):
+        since, until = START + timedelta(seconds=2), START + timedelta(seconds=3)
+        self.assertEqual(self.ids(self.index.search(since=since, until=until)), (2, [("t2", "c"), ("t1", "b")]))
+        self.assertEqual(self.ids(self.index.search(offset=1, limit=2)), (4, [("t2", "c"), ("t1", "b")]))
+
+    def test_evicted_messages_leave_the_index(self):
+        index = HistoryIndex()
+        thread = ThreadStore(maxlen=2, thread_id="t1", search_index=index)
+        for item_id, seconds in (("a", 1), ("b", 2), ("c", 3)):
+            thread.add(record(item_id, seconds, f"message {item_id}"))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(self.ids(index.search(query="message")), (2, [("t1", "c"), ("t1", "b")]))
+        self.assertEqual(self.ids(index.search(query="a")), (0, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from templates import PromptTemplate
+
+
+class PromptTemplateTest(unittest.TestCase):
+    def test_renders_like_str_format(self):
+        text = "Hi {name}, today is {date}. {{literal braces}}"
+        template = PromptTemplate(text)
+        self.assertEqual(template.fields, {"name", "date"})
+        self.assertEqual(template.render(name="Sam", date="Monday"), text.format(name="Sam", date="Monday"))
+
+    def test_bind_fills_fields_permanently(self):
+        template = PromptTemplate("{bot} talks to {user} about {topic}")
+        bound = template.bind(bot="Raphael")
+        self.assertEqual(bound.fields, {"user", "topic"})
+        self.assertEqual(bound.render(user="Sam", topic="cakes"), "Raphael talks to Sam about cakes")
+        # The original template is left unchanged
+        self.assertEqual(template.render(bot="B", user="U", topic="T"), "B talks to U about T")
+
+    def test_missing_field_raises(self):
+        with self.assertRaises(KeyError):
+            PromptTemplate("{a} and {b}").render(a=1)
+
+    def test_rejects_format_specs_and_attribute_fields(self):
+        for text in ("{count:>5}", "{name!r}", "{user.name}"):
+            with self.assertRaises(ValueError):
+                PromptTemplate(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import threading
+import unittest
+
+from workqueue import PriorityWorkQueue
+
+CLASSES = ("owner", "escalation", "regular")
+TIMEOUT = 5
+
+
+class PriorityWorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.ran = []
+        self.ran_lock = threading.Lock()
+        self.queue = None
+
+    def tearDown(self):
+        if self.queue is not None:
+            self.queue.shutdown(wait=True)
+
+    def record(self, key, *args):
+        with self.ran_lock:
+            self.ran.append((key,) + args)
+
+    def block(self, started, release):
+        started.set()
+        release.wait(TIMEOUT)
+
+    def occupy_worker(self):
+        """Keeps the queue's single worker busy until the returned event is set."""
+        started, release = threading.Event(), threading.Event()
+        self.queue.submit("blocker", "regular", self.block, started, release)
+        self.assertTrue(started.wait(TIMEOUT))
+        return release
+
+    def test_runs_classes_in_priority_order(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=1)
+        release = self.occupy_worker()
+        self.queue.submit("a", "regular", self.record, "a")
+        self.queue.submit("b", "escalation", self.record, "b")
+        self.queue.submit("c", "owner", self.record, "c")
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.ran, [("c",), ("b",), ("a",)])
+
+    def test_keeps_submission_order_within_a_class(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=1)
+        release = self.occupy_worker()
+        for key in ("first", "second", "third"):
+            self.queue.submit(key, "regular", self.record, key)
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.ran, [("first",), ("second",), ("third",)])
+
+    def test_queued_key_is_not_queued_twice(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=1)
+        release = self.occupy_worker()
+        self.assertTrue(self.queue.submit("thread", "regular", self.record, "thread", 1))
+        # A second submission replaces the arguments instead of adding work
+        self.assertFalse(self.queue.submit("thread", "regular", self.record, "thread", 2))
+        self.assertEqual(self.queue.pending(), 2)
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.ran, [("thread", 2)])
+
+    def test_resubmitting_with_a_higher_class_promotes_the_item(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=1)
+        release = self.occupy_worker()
+        self.queue.submit("a", "regular", self.record, "a")
+        self.queue.submit("b", "regular", self.record, "b")
+        self.queue.submit("b", "owner", self.record, "b")
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.ran, [("b",), ("a",)])
+        self.assertEqual(self.queue.stats()["completed"], {"owner": 1, "escalation": 0, "regular": 2})
+
+    def test_running_key_is_not_queued_again(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=2)
+        started, release = threading.Event(), threading.Event()
+        self.queue.submit("thread", "regular", self.block, started, release)
+        self.assertTrue(started.wait(TIMEOUT))
+        self.assertFalse(self.queue.submit("thread", "regular", self.record, "thread"))
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.ran, [])
+
+    def test_class_limit_keeps_a_worker_free_for_higher_classes(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=2, limits={"regular": 1})
+        first_started, release = threading.Event(), threading.Event()
+        second_started = threading.Event()
+        self.queue.submit("r1", "regular", self.block, first_started, release)
+        self.assertTrue(first_started.wait(TIMEOUT))
+        self.queue.submit("r2", "regular", self.block, second_started, release)
+        owner_done = threading.Event()
+        self.queue.submit("o1", "owner", lambda: owner_done.set())
+        # The owner item gets the free worker while the second regular item waits for the first
+        self.assertTrue(owner_done.wait(TIMEOUT))
+        self.assertFalse(second_started.is_set())
+        self.assertEqual(self.queue.stats()["queued"]["regular"], 1)
+        release.set()
+        self.assertTrue(second_started.wait(TIMEOUT))
+
+    def test_checkpoint_is_reached_once_its_items_have_finished(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=1)
+        release = self.occupy_worker()
+        self.queue.submit("a", "regular", self.record, "a")
+        self.queue.checkpoint(1)
+        self.assertIsNone(self.queue.reached())
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.queue.reached(), 1)
+
+    def test_checkpoint_waits_for_a_key_that_was_running(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=2)
+        release = self.occupy_worker()
+        # The blocker is already running, so this submission is dropped, but the checkpoint still waits for it
+        self.assertFalse(self.queue.submit("blocker", "regular", self.record, "blocker"))
+        self.queue.checkpoint(1)
+        self.assertIsNone(self.queue.reached())
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.queue.reached(), 1)
+
+    def test_later_checkpoint_waits_for_earlier_ones(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=2, limits={"regular": 1})
+        release = self.occupy_worker()
+        self.queue.checkpoint(1)
+        owner_done = threading.Event()
+        self.queue.submit("o1", "owner", lambda: owner_done.set())
+        self.assertTrue(owner_done.wait(TIMEOUT))
+        # Checkpoint 2 has nothing left to wait for, but checkpoint 1 still waits for the blocker
+        self.queue.checkpoint(2)
+        self.assertIsNone(self.queue.reached())
+        release.set()
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.queue.reached(), 2)
+
+    def test_failing_item_does_not_stop_the_worker(self):
+        self.queue = PriorityWorkQueue(CLASSES, workers=1)
+
+        def fail():
+            raise RuntimeError("boom")
+        self.queue.submit("bad", "regular", fail)
+        self.queue.submit("good", "regular", self.record, "good")
+        self.queue.shutdown(wait=True)
+        self.assertEqual(self.ran, [("good",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
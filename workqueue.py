@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+
+class WorkItem:
+    __slots__ = ("key", "priority_class", "function", "args", "queued_at")
+
+    def __init__(self, key, priority_class, function, args):
+        self.key = key
+        self.priority_class = priority_class
+        self.function = function
+        self.args = args
+        self.queued_at = time.monotonic()
+
+
+class PriorityWorkQueue:
+    """
+    Runs work on a pool of `workers` threads, taking items from the first class in
+    `classes` that has any waiting. A class with a limit in `limits` never has more
+    than that many items running at once, which keeps workers free for the classes
+    before it. Each key (e.g. a thread ID) is queued or running at most once; within
+    a class items run in the order they were queued, so a busy key goes to the back
+    of its class once it is done and cannot starve the others.
+    If a Metrics instance is given, the time each item waited and ran is recorded
+    per class as the "queue_wait" and "work" stages.
+    A checkpoint (see checkpoint()) is reached once everything that was queued or
+    running when it was taken has finished.
+    """
+
+    def __init__(self, classes, workers=1, limits=None, metrics=None):
+        self.classes = list(classes)
+        self.limits = dict(limits or {})
+        self.metrics = metrics
+        self.completed = dict.fromkeys(self.classes, 0)
+        self._queues = {priority_class: deque() for priority_class in self.classes}
+        self._queued = {}  # key -> WorkItem waiting to run
+        self._running = {}  # key -> WorkItem running
+        self._checkpoints = deque()  # [token, WorkItems still to finish], oldest first
+        self._reached = None
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._workers = [threading.Thread(target=self._run, name=f"work-{index}", daemon=True) for index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, priority_class, function, *args):
+        """
+        Queues function(*args) under `key`. If the key is already waiting, its arguments
+        are replaced with these and it moves up if `priority_class` comes first; if it is
+        running, nothing is queued. Returns False if nothing was queued.
+        """
+        with self._condition:
+            if key in self._running:
+                return False
+            item = self._queued.get(key)
+            if item is not None:
+                item.args = args
+                if self.classes.index(priority_class) < self.classes.index(item.priority_class):
+                    self._queues[item.priority_class].remove(item)
+                    item.priority_class = priority_class
+                    self._queues[priority_class].append(item)
+                    self._condition.notify()
+                return False
+            item = self._queued[key] = WorkItem(key, priority_class, function, args)
+            self._queues[priority_class].append(item)
+            self._condition.notify()
+            return True
+
+    def _next_item(self):
+        for priority_class in self.classes:
+            queue = self._queues[priority_class]
+            limit = self.limits.get(priority_class)
+            if queue and (not limit or sum(1 for running in self._running.values() if running.priority_class == priority_class) < limit):
+                item = queue.popleft()
+                del self._queued[item.key]
+                self._running[item.key] = item
+                return item
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                item = self._next_item()
+                while item is None:
+                    if self._stopping and not self._queued:
+                        return
+                    self._condition.wait()
+                    item = self._next_item()
+            started_at = time.monotonic()
+            if self.metrics:
+                self.metrics.observe("stage_seconds", started_at - item.queued_at, stage="queue_wait", priority=item.priority_class)
+            try:
+                with self.metrics.timed("work", priority=item.priority_class) if self.metrics else nullcontext():
+                    item.function(*item.args)
+            except Exception as e:
+                print(f"Work item {item.key} failed: {e}")
+            with self._condition:
+                del self._running[item.key]
+                self.completed[item.priority_class] += 1
+                for _, waiting in self._checkpoints:
+                    waiting.discard(item)
+                # A finished item may have been holding back its class's limit
+                self._condition.notify_all()
+
+    def pending(self):
+        """Returns the number of items waiting or running."""
+        with self._condition:
+            return len(self._queued) + len(self._running)
+
+    def checkpoint(self, token):
+        """Notes `token` (e.g. the start of a poll cycle), to be reached once everything queued or running now has finished."""
+        with self._condition:
+            self._checkpoints.append([token, set(self._queued.values()) | set(self._running.values())])
+
+    def reached(self):
+        """Returns the newest checkpoint token reached along with every checkpoint before it, or None."""
+        with self._condition:
+            while self._checkpoints and not self._checkpoints[0][1]:
+                self._reached = self._checkpoints.popleft()[0]
+            return self._reached
+
+    def shutdown(self, wait=True):
+        """Stops the workers once everything already queued has run."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queued": {priority_class: len(queue) for priority_class, queue in self._queues.items()},
+                "running": len(self._running),
+                "completed": dict(self.completed),
+            }